@@ -0,0 +1,215 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+from types import SimpleNamespace
+from typing import Awaitable, Callable
+
+from benchmarks.generator import MIGRATIONS_FOLDER, create_db
+from src.bot.callbacks.schedule import get_schedule_page
+from src.context.callback_store import CallbackStore
+from src.utils.chart_cache import ChartCache
+from src.utils.charts import ChartRenderer
+from src.utils.db import Db
+from src.utils.reports import Reporter
+from src.utils.sql_reports import SqlReporter
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+DATA_FOLDER = os.path.join(BENCHMARKS_FOLDER, "data")
+RESULTS_FOLDER = os.path.join(BENCHMARKS_FOLDER, "results")
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+CHART_CACHE_MAX_BYTES = 64 * 1024 * 1024
+YEAR = (date(2024, 1, 1), date(2025, 1, 1))
+MONTH = (date(2024, 6, 1), date(2024, 7, 1))
+
+logger = logging.getLogger("benchmarks")
+
+
+def get_repeat(loans: int) -> int:
+    return max(3, min(30, 1_000_000 // loans))
+
+
+# dbs are generated once per size and seed, every benchmark run works on a fresh copy since some cases write
+async def get_db_file(loans: int, seed: int) -> str:
+    os.makedirs(DATA_FOLDER, exist_ok=True)
+    filename = os.path.join(DATA_FOLDER, f"loans_{loans}_seed_{seed}.db")
+    if not os.path.exists(filename):
+        logger.info(f"Generating {loans} loans into {filename}")
+        # a partially generated db must not be taken for a complete one by the next run
+        (await create_db(filename + ".tmp", loans, seed=seed)).close()
+        os.replace(filename + ".tmp", filename)
+    return filename
+
+
+async def get_db(folder: str, loans: int, seed: int) -> Db:
+    filename = os.path.join(folder, "db.db")
+    shutil.copy(await get_db_file(loans, seed), filename)
+    return Db(filename, MIGRATIONS_FOLDER)
+
+
+async def measure(
+        func: Callable[[], Awaitable],
+        repeat: int,
+        setup: Callable[[], Awaitable] | None = None) -> dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            await setup()
+        started = time.perf_counter()
+        await func()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "runs": len(timings),
+        "min_ms": timings[0],
+        "median_ms": statistics.median(timings),
+        "p95_ms": timings[min(len(timings) - 1, round(0.95 * (len(timings) - 1)))],
+        "mean_ms": statistics.fmean(timings)
+    }
+
+
+async def run_size(loans: int, seed: int, renderer: ChartRenderer) -> dict[str, dict[str, float]]:
+    with tempfile.TemporaryDirectory() as folder:
+        db = await get_db(folder, loans, seed)
+        try:
+            return await run_cases(db, loans, renderer)
+        finally:
+            db.close()
+
+
+async def run_cases(db: Db, loans: int, renderer: ChartRenderer) -> dict[str, dict[str, float]]:
+    repeat = get_repeat(loans)
+    reporter = Reporter(db, renderer, ChartCache(CHART_CACHE_MAX_BYTES))
+    sql_reporter = SqlReporter(db, renderer, ChartCache(CHART_CACHE_MAX_BYTES))
+    context = SimpleNamespace(db=db, callbacks=CallbackStore(db, 60.), SCHEDULE_PAGE_SIZE=15)
+    unsettled = [loan[0] for loan in await db.get_unsettled_loans()]
+    results = dict()
+
+    async def invalidate_unsettled_loans() -> None:
+        db._invalidate_unsettled_loans()
+
+    async def settle_next_loan() -> None:
+        await db.settle_loan(unsettled.pop(), date(2026, 1, 1))
+
+    async def reset_reporter() -> None:
+        reporter.version = -1
+
+    async def clear_chart_cache() -> None:
+        reporter.cache = ChartCache(CHART_CACHE_MAX_BYTES)
+        sql_reporter.cache = ChartCache(CHART_CACHE_MAX_BYTES)
+
+    async def get_last_schedule_page() -> None:
+        await get_schedule_page(context, len(unsettled) // context.SCHEDULE_PAGE_SIZE)
+
+    cases = [
+        ("db.get_unsettled_loans.cold", db.get_unsettled_loans, invalidate_unsettled_loans),
+        ("db.get_unsettled_loans.cached", db.get_unsettled_loans, None),
+        ("db.settle_loan", settle_next_loan, None),
+        ("reporter.get_movements.full", reporter.get_movements, reset_reporter),
+        ("reporter.get_movements.incremental", reporter.get_movements, settle_next_loan),
+        ("reporter.get_graphic_by_sources.all_time",
+         lambda: reporter.get_graphic_by_sources('source_name'), clear_chart_cache),
+        ("reporter.get_graphic_by_sources.year",
+         lambda: reporter.get_graphic_by_sources('source_name', *YEAR), clear_chart_cache),
+        ("reporter.get_graphic_by_sources.month",
+         lambda: reporter.get_graphic_by_sources('source_name', *MONTH), clear_chart_cache),
+        ("sql_reporter.get_graphic_by_sources.all_time",
+         lambda: sql_reporter.get_graphic_by_sources('source_name'), clear_chart_cache),
+        ("sql_reporter.get_graphic_by_sources.year",
+         lambda: sql_reporter.get_graphic_by_sources('source_name', *YEAR), clear_chart_cache),
+        ("sql_reporter.get_graphic_by_sources.month",
+         lambda: sql_reporter.get_graphic_by_sources('source_name', *MONTH), clear_chart_cache),
+        ("schedule.first_page", lambda: get_schedule_page(context, 0), None),
+        ("schedule.last_page", get_last_schedule_page, None),
+    ]
+    for name, func, setup in cases:
+        # charts are rendered by worker processes, a few runs are enough for them at any size
+        case_repeat = min(repeat, 5) if ".get_graphic" in name else repeat
+        if settle_next_loan in (func, setup):
+            case_repeat = min(case_repeat, len(unsettled) - 1)
+        if case_repeat <= 0:
+            continue
+        if ".get_graphic" in name:
+            await reporter.get_movements()
+            await sql_reporter.get_movements()
+        results[name] = await measure(func, case_repeat, setup)
+        logger.info(f"{loans:>9} {name:<45} median {results[name]['median_ms']:10.2f} ms")
+    return results
+
+
+def get_metadata(seed: int) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=BENCHMARKS_FOLDER
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed
+    }
+
+
+# prints median ratios against a previous run, returns True if any of them exceeds the threshold
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    regressed = False
+    for size, cases in results["results"].items():
+        for name, stats in cases.items():
+            old = baseline["results"].get(size, dict()).get(name)
+            if old is None:
+                continue
+            ratio = stats["median_ms"] / max(old["median_ms"], 1e-6)
+            mark = ""
+            if ratio > 1 + threshold:
+                mark = "REGRESSION"
+                regressed = True
+            print(f"{size:>9} {name:<45} {old['median_ms']:10.2f} -> {stats['median_ms']:10.2f} ms "
+                  f"({ratio:5.2f}x) {mark}")
+    return regressed
+
+
+async def main(sizes: list[int], seed: int) -> dict:
+    renderer = ChartRenderer(workers=2)
+    try:
+        results = {str(loans): await run_size(loans, seed, renderer) for loans in sizes}
+    finally:
+        renderer.close()
+    return {"metadata": get_metadata(seed), "results": results}
+
+
+if __name__ == '__main__':
+    # the db logs every connection and migration at info level, only the benchmark lines are interesting here
+    logging.basicConfig(level=logging.WARNING, stream=sys.stdout, format="%(message)s")
+    logger.setLevel(logging.INFO)
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the db, reports and schedule")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="numbers of loans, 1000000 takes a few minutes to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help=f"results file, a new one in {RESULTS_FOLDER} by default")
+    parser.add_argument("--compare", default=None, help="results file of a previous run")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown of medians")
+    args = parser.parse_args()
+    results = asyncio.run(main(args.sizes, args.seed))
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+        output = os.path.join(RESULTS_FOLDER, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "wt", encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results are saved to {output}")
+    if args.compare is not None:
+        with open(args.compare, "rt", encoding='utf-8') as f:
+            baseline = json.load(f)
+        sys.exit(1 if compare(results, baseline, args.threshold) else 0)
@@ -0,0 +1,94 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+from datetime import date, timedelta
+from typing import Iterator
+
+from src.utils.db import Db, to_day
+
+MIGRATIONS_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+START_DATE = date(2018, 1, 1)
+END_DATE = date(2025, 12, 31)
+BATCH_SIZE = 100_000
+
+
+# yields chains of loans in the import format of Db.import_loans, every loan except the last one
+# of a chain is prolonged into the next one, ids are consecutive so chains never refer to other batches
+def generate_chains(rng: random.Random, loans: int, sources: int, legends: int) -> Iterator[list[tuple]]:
+    loan_id = 1
+    days = (END_DATE - START_DATE).days
+    while loan_id <= loans:
+        source_id = rng.randint(1, sources)
+        legend_id = rng.randint(1, legends)
+        loan_date = START_DATE + timedelta(days=rng.randint(0, days))
+        amount = rng.randint(1, 100) * 1000
+        chain = []
+        while True:
+            term = rng.randint(7, 90)
+            reward = amount * rng.randint(5, 30) // 100
+            expected_settle_date = loan_date + timedelta(days=term)
+            settle_date = loan_date + timedelta(days=max(1, term + rng.randint(-5, 5)))
+            if settle_date > END_DATE or rng.random() < 0.05:
+                settle_date = None
+            prolonged = settle_date is not None and loan_id < loans and rng.random() < 0.3
+            comment = f"comment {loan_id}" if rng.random() < 0.1 else None
+            chain.append((
+                loan_id,
+                source_id,
+                to_day(loan_date),
+                amount,
+                to_day(expected_settle_date),
+                reward,
+                to_day(settle_date) if settle_date is not None else None,
+                loan_id + 1 if prolonged else None,
+                legend_id,
+                comment
+            ))
+            loan_id += 1
+            if not prolonged:
+                break
+            # the borrower pays back a part of the duty and the rest becomes a new loan
+            total = amount + reward
+            amount = max(1000, total - rng.randint(0, total // 1000) * 1000)
+            loan_date = settle_date
+        yield chain
+
+
+async def generate(db: Db, loans: int, sources: int = 5, legends: int = 20, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    for i in range(sources):
+        await db.add_source(f"source_{i + 1}")
+    for i in range(legends):
+        await db.add_legend_source(f"legend_{i + 1}")
+    batch = []
+    for chain in generate_chains(rng, loans, sources, legends):
+        batch.extend(chain)
+        if len(batch) >= BATCH_SIZE:
+            if not await db.import_loans(batch):
+                raise RuntimeError("Cannot import generated loans")
+            batch = []
+    if batch and not await db.import_loans(batch):
+        raise RuntimeError("Cannot import generated loans")
+
+
+async def create_db(filename: str, loans: int, sources: int = 5, legends: int = 20, seed: int = 0) -> Db:
+    if os.path.exists(filename):
+        raise FileExistsError(filename)
+    db = Db(filename, MIGRATIONS_FOLDER)
+    await generate(db, loans, sources, legends, seed)
+    return db
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    parser = argparse.ArgumentParser(description="Fills a new db with a deterministic synthetic loan book")
+    parser.add_argument("filename")
+    parser.add_argument("--loans", type=int, default=10_000)
+    parser.add_argument("--sources", type=int, default=5)
+    parser.add_argument("--legends", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(create_db(args.filename, args.loans, args.sources, args.legends, args.seed)).close()
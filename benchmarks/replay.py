@@ -0,0 +1,284 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from traceback import format_exc
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageText, SendDocument, SendMediaGroup, SendMessage, TelegramMethod
+from aiogram.types import Update, Message, Chat, User, CallbackQuery, PhotoSize, InlineKeyboardMarkup
+
+from benchmarks.bench import RESULTS_FOLDER, get_db_file, get_metadata
+from src.bot.haperych_bot import HaperychBot
+from src.context.context import Context
+
+PROJECT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_CHAT_ID = 1000
+MAX_WIZARD_STEPS = 12
+DEFAULT_WIZARDS = ["loan", "payback", "schedule", "analytics"]
+
+logger = logging.getLogger("benchmarks")
+
+
+# answers every request of the bot locally and keeps outgoing calls by chat instead of sending them to telegram
+class StubSession(BaseSession):
+    def __init__(self):
+        super().__init__()
+        self.calls: dict[int, list[TelegramMethod]] = defaultdict(list)
+        self.ids = itertools.count(1)
+
+    async def make_request(self, bot, method: TelegramMethod, timeout: int | None = None):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return True
+        self.calls[chat_id].append(method)
+        chat = Chat(id=chat_id, type="private")
+        if isinstance(method, SendMediaGroup):
+            messages = []
+            for _ in method.media:
+                message_id = next(self.ids)
+                messages.append(Message(message_id=message_id, date=datetime.now(), chat=chat, photo=[
+                    PhotoSize(file_id=f"photo_{message_id}", file_unique_id=f"photo_{message_id}", width=1, height=1)
+                ]))
+            return messages
+        if isinstance(method, (SendMessage, EditMessageText, SendDocument)):
+            return Message(message_id=next(self.ids), date=datetime.now(), chat=chat, text=getattr(method, "text", None))
+        return True
+
+    async def stream_content(self, url: str, headers: dict | None = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True):
+        raise RuntimeError("files cannot be downloaded in a replay")
+        # never reached, the yield makes this an async generator like the method of BaseSession,
+        # so that callers iterating it with async for get the error above instead of a TypeError
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+class Replayer:
+    def __init__(self, bot: HaperychBot, session: StubSession, record: list[str] | None = None):
+        self.bot = bot
+        self.session = session
+        self.record = record
+        self.ids = itertools.count(1)
+        self.aliases: dict[str, str] = bot.context.BUTTON_TO_ALIAS
+        self.timings: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.last_texts: dict[int, str] = dict()
+
+    def get_handler_name(self, update: Update) -> str:
+        if update.message is not None:
+            return f"message:{self.aliases.get(update.message.text, 'input')}"
+        return f"callback:{update.callback_query.data.split('_')[0]}"
+
+    def message(self, chat_id: int, text: str) -> Update:
+        return Update(update_id=next(self.ids), message=Message(
+            message_id=next(self.ids),
+            date=datetime.now(),
+            chat=Chat(id=chat_id, type="private"),
+            from_user=User(id=chat_id, is_bot=False, first_name="user"),
+            text=text
+        ))
+
+    def callback(self, chat_id: int, data: str) -> Update:
+        return Update(update_id=next(self.ids), callback_query=CallbackQuery(
+            id=str(next(self.ids)),
+            chat_instance=str(chat_id),
+            from_user=User(id=chat_id, is_bot=False, first_name="user"),
+            message=Message(
+                message_id=next(self.ids),
+                date=datetime.now(),
+                chat=Chat(id=chat_id, type="private"),
+                text=self.last_texts.get(chat_id)
+            ),
+            data=data
+        ))
+
+    # handlers answer a token they cannot decode with an error message and go on, so a recording replayed
+    # against another loan book or bot version would be measured as if it worked, it is stopped instead
+    async def check_callback(self, update: Update) -> None:
+        if update.callback_query is not None and await self.bot.context.callbacks.decode(update.callback_query.data) is None:
+            raise RuntimeError(f"callback data {update.callback_query.data} of update {update.update_id} does not "
+                               f"resolve, the recording does not match the loan book or the version of the bot")
+
+    # returns the calls the bot made to the chat of the update while handling it
+    async def feed(self, update: Update) -> list[TelegramMethod]:
+        chat_id = update.message.chat.id if update.message is not None else update.callback_query.message.chat.id
+        if self.record is not None:
+            self.record.append(update.model_dump_json(exclude_none=True, by_alias=True))
+        calls = self.session.calls[chat_id]
+        count = len(calls)
+        name = self.get_handler_name(update)
+        started = time.perf_counter()
+        try:
+            await self.bot.dp.feed_update(self.bot.bot, update)
+        except Exception:
+            # polling only logs errors of handlers, so the replay goes on as well
+            logging.error(f"An error occurred while handling {name}")
+            logging.error(format_exc())
+            self.errors[name] += 1
+        self.timings[name].append(time.perf_counter() - started)
+        calls = calls[count:]
+        for call in calls:
+            if getattr(call, "text", None) is not None:
+                self.last_texts[chat_id] = call.text
+        return calls
+
+
+def get_buttons(calls: list[TelegramMethod]) -> list[str]:
+    buttons = []
+    for call in calls:
+        markup = getattr(call, "reply_markup", None)
+        if isinstance(markup, InlineKeyboardMarkup):
+            buttons = [button.callback_data for row in markup.inline_keyboard for button in row]
+    return buttons
+
+
+# a user opens random wizards and goes through them by clicking random buttons, sometimes typing numbers instead
+async def run_user(replayer: Replayer, chat_id: int, wizard_buttons: list[str], sessions: int, rng: random.Random) -> None:
+    for _ in range(sessions):
+        calls = await replayer.feed(replayer.message(chat_id, rng.choice(wizard_buttons)))
+        for _ in range(MAX_WIZARD_STEPS):
+            buttons = get_buttons(calls)
+            if not buttons:
+                break
+            if "введите" in (replayer.last_texts.get(chat_id) or "") and rng.random() < 0.3:
+                calls = await replayer.feed(replayer.message(chat_id, str(rng.randint(1, 30) * 1000)))
+            else:
+                calls = await replayer.feed(replayer.callback(chat_id, rng.choice(buttons)))
+
+
+def percentile(timings: list[float], q: float) -> float:
+    return timings[min(len(timings) - 1, round(q * (len(timings) - 1)))] * 1000
+
+
+def get_report(timings: dict[str, list[float]], errors: dict[str, int], elapsed: float) -> dict:
+    handlers = dict()
+    for name, values in sorted(timings.items()):
+        values = sorted(values)
+        handlers[name] = {
+            "count": len(values),
+            "errors": errors.get(name, 0),
+            "p50_ms": percentile(values, 0.5),
+            "p95_ms": percentile(values, 0.95),
+            "p99_ms": percentile(values, 0.99),
+            "max_ms": values[-1] * 1000
+        }
+    updates = sum(len(values) for values in timings.values())
+    return {"updates": updates, "elapsed_s": elapsed, "updates_per_s": updates / max(elapsed, 1e-9), "handlers": handlers}
+
+
+def print_report(report: dict) -> None:
+    print(f"{'handler':<24} {'count':>7} {'errors':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for name, stats in report["handlers"].items():
+        print(f"{name:<24} {stats['count']:>7} {stats['errors']:>7} {stats['p50_ms']:>10.2f} {stats['p95_ms']:>10.2f} "
+              f"{stats['p99_ms']:>10.2f} {stats['max_ms']:>10.2f}")
+    print(f"{report['updates']} updates in {report['elapsed_s']:.2f} s, {report['updates_per_s']:.1f} updates/s")
+
+
+# the bot reads its config, migrations and db from the dev folder inside HOME, so a temporary one is set up
+async def prepare_home(home: str, loans: int, seed: int, users: int) -> None:
+    project = os.path.join(home, "PycharmProjects", "haperychProject")
+    os.makedirs(os.path.join(project, "db_data"))
+    os.symlink(os.path.join(PROJECT_FOLDER, "config"), os.path.join(project, "config"))
+    os.symlink(os.path.join(PROJECT_FOLDER, "migrations"), os.path.join(project, "migrations"))
+    shutil.copy(await get_db_file(loans, seed), os.path.join(project, "db_data", "db.db"))
+    os.environ.update({
+        "HOME": home,
+        "ENVIRONMENT": "dev",
+        "BOT_TOKEN": "123456:replay",
+        "ADMIN_ID": str(FIRST_CHAT_ID),
+        "ALLOWED_CHAT_IDS": ",".join(str(FIRST_CHAT_ID + i) for i in range(users))
+    })
+
+
+# the first line of a recording keeps the arguments of the loan book it was recorded against,
+# callback tokens of the recording resolve only with the same book
+def read_recording(path: str) -> tuple[dict, list[Update]]:
+    with open(path, "rt", encoding='utf-8') as f:
+        lines = [line for line in f if line.strip()]
+    arguments = dict()
+    if lines and "replay_arguments" in json.loads(lines[0]):
+        arguments = json.loads(lines.pop(0))["replay_arguments"]
+    return arguments, [Update.model_validate_json(line) for line in lines]
+
+
+async def main(args: argparse.Namespace) -> dict:
+    updates = []
+    if args.replay is not None:
+        arguments, updates = read_recording(args.replay)
+        if not arguments:
+            logger.warning(f"{args.replay} does not keep its loan book, replaying against --loans {args.loans} --seed {args.seed}")
+        for name, value in arguments.items():
+            if getattr(args, name) != value:
+                logger.info(f"using {name} {value} of the recording instead of {getattr(args, name)}")
+                setattr(args, name, value)
+    with tempfile.TemporaryDirectory() as home:
+        await prepare_home(home, args.loans, args.seed, args.users)
+        context = Context()
+        bot = HaperychBot(context)
+        session = StubSession()
+        bot.bot.session = session
+        record = [] if args.record is not None else None
+        replayer = Replayer(bot, session, record)
+        try:
+            await bot.dp.emit_startup(bot=bot.bot)
+            started = time.perf_counter()
+            if args.replay is not None:
+                for update in updates:
+                    await replayer.check_callback(update)
+                    await replayer.feed(update)
+            else:
+                button_by_alias = {alias: button for button, alias in context.BUTTON_TO_ALIAS.items()}
+                wizard_buttons = [button_by_alias[alias] for alias in args.wizards]
+                await asyncio.gather(*(
+                    run_user(replayer, FIRST_CHAT_ID + i, wizard_buttons, args.sessions, random.Random(args.seed + i))
+                    for i in range(args.users)
+                ))
+            elapsed = time.perf_counter() - started
+        finally:
+            await bot.dp.emit_shutdown(bot=bot.bot)
+            context.renderer.close()
+            context.db.close()
+    if record is not None:
+        with open(args.record, "wt", encoding='utf-8') as f:
+            f.write(json.dumps({"replay_arguments": {"loans": args.loans, "seed": args.seed}}) + "\n")
+            f.writelines(line + "\n" for line in record)
+    return get_report(replayer.timings, replayer.errors, elapsed)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING, stream=sys.stdout, format="%(message)s")
+    logger.setLevel(logging.INFO)
+    parser = argparse.ArgumentParser(description="Feeds generated or recorded updates to the bot with a stub telegram api")
+    parser.add_argument("--loans", type=int, default=10_000, help="size of the generated loan book")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--users", type=int, default=4, help="chats sending updates concurrently")
+    parser.add_argument("--sessions", type=int, default=20, help="wizards opened by every user")
+    parser.add_argument("--wizards", nargs="+", default=DEFAULT_WIZARDS)
+    parser.add_argument("--replay", default=None,
+                        help="jsonl file of recorded updates, they are fed one by one in the recorded order "
+                             "against the loan book of the recording, a callback that does not resolve stops the replay")
+    parser.add_argument("--record", default=None,
+                        help="jsonl file to save the fed updates to, record a single user to replay it exactly")
+    parser.add_argument("--output", default=None, help="json file for the report")
+    args = parser.parse_args()
+    report = asyncio.run(main(args))
+    print_report(report)
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+        output = os.path.join(RESULTS_FOLDER, f"replay-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "wt", encoding='utf-8') as f:
+        json.dump({"metadata": get_metadata(args.seed), "arguments": vars(args), "report": report}, f, indent=2)
+    print(f"Report is saved to {output}")
@@ -0,0 +1,9 @@
+CREATE INDEX IF NOT EXISTS loans_unsettled_by_due_date
+    ON loans (expected_settle_date)
+    WHERE settle_date IS NULL;
+
+CREATE INDEX IF NOT EXISTS loans_source_id
+    ON loans (source_id);
+
+CREATE INDEX IF NOT EXISTS loans_legend_source_id
+    ON loans (legend_source_id);
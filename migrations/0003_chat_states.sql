@@ -0,0 +1,6 @@
+CREATE TABLE IF NOT EXISTS chat_states
+    (
+    chat_id INTEGER PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+    );
@@ -0,0 +1,11 @@
+CREATE TABLE IF NOT EXISTS callback_payloads
+    (
+    id INTEGER PRIMARY KEY,
+    prefix TEXT NOT NULL,
+    args TEXT NOT NULL,
+    expires_at REAL DEFAULT NULL
+    );
+
+CREATE INDEX IF NOT EXISTS callback_payloads_expires_at
+    ON callback_payloads (expires_at)
+    WHERE expires_at IS NOT NULL;
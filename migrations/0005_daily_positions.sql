@@ -0,0 +1,35 @@
+CREATE TABLE IF NOT EXISTS daily_positions
+    (
+    date DATE NOT NULL,
+    source_id INTEGER NOT NULL,
+    legend_source_id INTEGER NOT NULL,
+    day_movement INTEGER NOT NULL,
+    day_duty INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    duty INTEGER NOT NULL,
+    movements_count INTEGER NOT NULL,
+    PRIMARY KEY (date, source_id, legend_source_id)
+    ) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS daily_positions_series
+    ON daily_positions (source_id, legend_source_id, date);
+
+WITH movements(source_id, legend_source_id, date, movement, duty) AS (
+    SELECT source_id, legend_source_id, loan_date, -amount, amount + reward
+    FROM loans
+    UNION ALL
+    SELECT source_id, legend_source_id, settle_date, amount + reward, -(amount + reward)
+    FROM loans
+    WHERE settle_date IS NOT NULL
+),
+daily(source_id, legend_source_id, date, movement, duty, movements_count) AS (
+    SELECT source_id, 0, date, sum(movement), sum(duty), count(*) FROM movements GROUP BY source_id, date
+    UNION ALL
+    SELECT 0, legend_source_id, date, sum(movement), sum(duty), count(*) FROM movements GROUP BY legend_source_id, date
+    UNION ALL
+    SELECT 0, 0, date, sum(movement), sum(duty), count(*) FROM movements GROUP BY date
+)
+INSERT INTO daily_positions (date, source_id, legend_source_id, day_movement, day_duty, position, duty, movements_count)
+SELECT date, source_id, legend_source_id, movement, duty, sum(movement) OVER w, sum(duty) OVER w, movements_count
+FROM daily
+WINDOW w AS (PARTITION BY source_id, legend_source_id ORDER BY date);
@@ -0,0 +1,35 @@
+-- dates become numbers of days since 1970-01-01, DATE columns have numeric affinity and keep them as integers
+UPDATE loans
+SET loan_date = CAST(julianday(loan_date) - 2440587.5 AS INTEGER)
+WHERE typeof(loan_date) = 'text';
+
+UPDATE loans
+SET expected_settle_date = CAST(julianday(expected_settle_date) - 2440587.5 AS INTEGER)
+WHERE typeof(expected_settle_date) = 'text';
+
+UPDATE loans
+SET settle_date = CAST(julianday(settle_date) - 2440587.5 AS INTEGER)
+WHERE typeof(settle_date) = 'text';
+
+-- positions are rebuilt from the converted loans with the same query as in 0005
+DELETE FROM daily_positions;
+
+WITH movements(source_id, legend_source_id, date, movement, duty) AS (
+    SELECT source_id, legend_source_id, loan_date, -amount, amount + reward
+    FROM loans
+    UNION ALL
+    SELECT source_id, legend_source_id, settle_date, amount + reward, -(amount + reward)
+    FROM loans
+    WHERE settle_date IS NOT NULL
+),
+daily(source_id, legend_source_id, date, movement, duty, movements_count) AS (
+    SELECT source_id, 0, date, sum(movement), sum(duty), count(*) FROM movements GROUP BY source_id, date
+    UNION ALL
+    SELECT 0, legend_source_id, date, sum(movement), sum(duty), count(*) FROM movements GROUP BY legend_source_id, date
+    UNION ALL
+    SELECT 0, 0, date, sum(movement), sum(duty), count(*) FROM movements GROUP BY date
+)
+INSERT INTO daily_positions (date, source_id, legend_source_id, day_movement, day_duty, position, duty, movements_count)
+SELECT date, source_id, legend_source_id, movement, duty, sum(movement) OVER w, sum(duty) OVER w, movements_count
+FROM daily
+WINDOW w AS (PARTITION BY source_id, legend_source_id ORDER BY date);
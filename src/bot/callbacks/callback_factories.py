@@ -1,108 +1,106 @@
 import logging
 from abc import ABC, abstractmethod
-from datetime import date, datetime, timedelta
-from traceback import format_exc
+from datetime import date, timedelta
 from typing import Callable, Any
 
-from aiogram.types import CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, FSInputFile, \
-    InputMediaPhoto
+from aiogram.types import CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, \
+    InlineKeyboardMarkup, BufferedInputFile, InputMediaPhoto
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.utils.media_group import MediaGroupBuilder
 
+from src.bot.callbacks.schedule import SCHEDULE_PREFIX, get_schedule_page
+from src.context.chat_state import ChatState
 from src.context.context import Context
+from src.utils.chart_cache import Chart
+
+MEDIA_GROUP_SIZE = 10
 
 
 class CallbackFactory(ABC):
     prefix: str = "unknown"
+    # used for values typed by the user and for payloads restored from the db
+    deserializers: list[Callable[[str], Any]] = []
     def __init__(self, context: Context):
         self.context = context
-        self.deserializers: list[Callable[[str], Any]] = []
-        self.args_count: int = 0
+        self.context.callbacks.register(self.prefix, self.deserializers)
 
     def get_kb(self) -> ReplyKeyboardMarkup:
         buttons = [KeyboardButton(text=k) for k in self.context.BUTTON_TO_ALIAS]
         buttons = [buttons[i: i + 2] for i in range(0, len(buttons), 2)]
         return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True, one_time_keyboard=False)
 
-    def _preproc(self, callback_data: str) -> list:
-        self.args_count = 0
-        args = callback_data.split('_')[1: ]
-        deserialized_args = [None] * len(self.deserializers)
-        length = min(len(args), len(self.deserializers))
-        for i, (arg, deserializer) in enumerate(
-                zip(
-                    args[: length],
-                    self.deserializers[: length]
-                )
-        ):
-            try:
-                deserialized_args[i] = deserializer(arg)
-                self.args_count += 1
-            except Exception as err:
-                logging.warning(f"Error {err} while processing args for {self.__class__.__name__} from {callback_data}")
-                logging.warning(format_exc())
-                break
-        return deserialized_args
+    async def _preproc(self, callback_data: str) -> tuple[int, list]:
+        args = await self.context.callbacks.decode(callback_data)
+        if args is None:
+            logging.warning(f"Cannot decode args for {self.__class__.__name__} from {callback_data}")
+            args = []
+        return len(args), args + [None] * (len(self.deserializers) - len(args))
 
-    @abstractmethod
-    def _parse_args(self, callback_data: str) -> None:
-        pass
+    def _next(self, args: list, value: Any) -> str:
+        return self.context.callbacks.encode(self.prefix, args + [value])
 
     @abstractmethod
-    async def callback(self, callback: CallbackQuery) -> None:
+    async def callback(self, callback: CallbackQuery, state: ChatState) -> None:
         pass
 
 
 class LoanCallbackFactory(CallbackFactory):
     prefix: str = "loan"
-    def __init__(self, context):
-        super().__init__(context)
-        self.source_id: int | None = None
-        self.legend_id: int | None = None
-        self.loan_date: date | None = None
-        self.expected_settle_date: date | None = None
-        self.amount: int | None = None
-        self.reward: int | None = None
-
-        self.deserializers: list[Callable[[str], Any]] = [
-            lambda x: int(x),
-            lambda x: int(x),
-            lambda x: datetime.strptime(x, "%Y-%m-%d").date(),
-            lambda x: datetime.strptime(x, "%Y-%m-%d").date(),
-            lambda x: int(x),
-            lambda x: int(x)
-        ]
+    deserializers: list[Callable[[str], Any]] = [
+        lambda x: int(x),
+        lambda x: int(x),
+        lambda x: date.fromisoformat(x),
+        lambda x: date.fromisoformat(x),
+        lambda x: int(x),
+        lambda x: int(x)
+    ]
 
-    def _parse_args(self, callback_data: str) -> None:
-        (self.source_id, self.legend_id, self.loan_date, self.expected_settle_date,
-         self.amount, self.reward) = self._preproc(callback_data)
+    def __init__(self, context: Context):
+        super().__init__(context)
+        # legends keyboards by source id, valid while dimensions of db stay the same
+        self.legends_keyboards: dict[int, InlineKeyboardMarkup] = dict()
+        self.legends_keyboards_version: int = -1
 
-    async def callback(self, callback: CallbackQuery) -> None:
-        self._parse_args(callback_data=callback.data)
-        if self.args_count == 1:
-            self.context.input_mode_callback_data = None
+    async def _get_legends_keyboard(self, source_id: int) -> InlineKeyboardMarkup:
+        if self.legends_keyboards_version != self.context.db.dimensions_version:
+            self.legends_keyboards_version = self.context.db.dimensions_version
+            self.legends_keyboards.clear()
+        if source_id not in self.legends_keyboards:
             builder = InlineKeyboardBuilder()
             buttons = [
-                InlineKeyboardButton(text=legend_name, callback_data=callback.data+f"_{legend_id}")
-                for legend_id, legend_name in self.context.db.get_legend_sources()
+                InlineKeyboardButton(
+                    text=legend_name,
+                    callback_data=self.context.callbacks.encode(self.prefix, [source_id, legend_id], pinned=True)
+                )
+                for legend_id, legend_name in await self.context.db.get_legend_sources()
             ]
             for but in buttons:
                 builder.row(but)
-            await callback.message.edit_text(text="А теперь выберите легенду", reply_markup=builder.as_markup())
-        elif self.args_count == 2:
-            self.context.input_mode_callback_data = None
+            self.legends_keyboards[source_id] = builder.as_markup()
+        return self.legends_keyboards[source_id]
+
+    async def callback(self, callback: CallbackQuery, state: ChatState) -> None:
+        args_count, args = await self._preproc(callback.data)
+        source_id, legend_id, loan_date, expected_settle_date, amount, reward = args
+        args = args[: args_count]
+        if args_count == 1:
+            state.input_mode_callback_data = None
+            await callback.message.edit_text(text="А теперь выберите легенду",
+                                             reply_markup=await self._get_legends_keyboard(source_id))
+        elif args_count == 2:
+            state.input_mode_callback_data = None
             builder = InlineKeyboardBuilder()
             buttons = [
                 InlineKeyboardButton(text=dt.strftime("%d.%m.%Y"),
-                                     callback_data=callback.data + f"_{dt.strftime('%Y-%m-%d')}")
+                                     callback_data=self._next(args, dt))
                 for dt in [date.today() + timedelta(days=i) for i in range(-7, 7)]
             ]
             builder.row(*buttons[: 7])
             builder.row(buttons[7])
             builder.row(*buttons[8:])
             await callback.message.edit_text(text="Выберите дату выдачи займа", reply_markup=builder.as_markup())
-        elif self.args_count == 3:
-            self.context.input_mode_callback_data = None
+        elif args_count == 3:
+            state.input_mode_callback_data = None
             builder = InlineKeyboardBuilder()
             month = date.today().month
             year = date.today().year
@@ -113,14 +111,14 @@ class LoanCallbackFactory(CallbackFactory):
                 buttons.append(
                     InlineKeyboardButton(
                         text=dt.strftime("%d.%m.%Y"),
-                        callback_data=callback.data+f"_{dt.strftime('%Y-%m-%d')}"
+                        callback_data=self._next(args, dt)
                     )
                 )
                 dt = date(year=year, month=month, day=last_day_of_month[month])
                 buttons.append(
                     InlineKeyboardButton(
                         text=dt.strftime("%d.%m.%Y"),
-                        callback_data=callback.data+f"_{dt.strftime('%Y-%m-%d')}"
+                        callback_data=self._next(args, dt)
                     )
                 )
                 year += month // 12
@@ -128,46 +126,46 @@ class LoanCallbackFactory(CallbackFactory):
             for i in range(0, len(buttons), 2):
                 builder.row(*buttons[i: i + 2])
             await callback.message.edit_text(text="Укажите ожидаемую дату возврата займа", reply_markup=builder.as_markup())
-        elif self.args_count == 4:
-            self.context.input_mode_callback_data = None
+        elif args_count == 4:
+            state.input_mode_callback_data = None
             builder = InlineKeyboardBuilder()
             buttons = [
-                InlineKeyboardButton(text=str(i), callback_data=callback.data + f"_{i}")
+                InlineKeyboardButton(text=str(i), callback_data=self._next(args, i))
                 for i in range(5000, 30001, 5000)
             ]
             for i in range(0, len(buttons), 2):
                 builder.row(*buttons[i: i + 2])
-            self.context.input_mode_callback_data = callback.data
+            state.input_mode_callback_data = callback.data
             await callback.message.edit_text(text="Выберите или введите сумму займа", reply_markup=builder.as_markup())
-        elif self.args_count == 5:
-            self.context.input_mode_callback_data = None
+        elif args_count == 5:
+            state.input_mode_callback_data = None
             builder = InlineKeyboardBuilder()
             buttons = [
-                InlineKeyboardButton(text=str(i), callback_data=callback.data+f"_{i}")
+                InlineKeyboardButton(text=str(i), callback_data=self._next(args, i))
                 for i in range(5000, 30001, 5000)
             ]
             for i in range(0, len(buttons), 2):
                 builder.row(*buttons[i: i + 2])
-            self.context.input_mode_callback_data = callback.data
+            state.input_mode_callback_data = callback.data
             await callback.message.edit_text(
                 text="Укажите или введите сумму процентов в рублях",
                 reply_markup=builder.as_markup()
             )
-        elif self.args_count == 6:
-            self.context.input_mode_callback_data = None
-            if self.context.db.create_loan(
-                    self.source_id,
-                    self.loan_date,
-                    self.amount,
-                    self.reward,
-                    self.expected_settle_date,
-                    self.legend_id
+        elif args_count == 6:
+            state.input_mode_callback_data = None
+            if await self.context.db.create_loan(
+                    source_id,
+                    loan_date,
+                    amount,
+                    reward,
+                    expected_settle_date,
+                    legend_id
             ):
                 await callback.message.answer(
-                    text=f"Займ от {self.context.db.get_legend_source_name_by_id(self.legend_id)}"
-                         f"({self.context.db.get_source_name_by_id(self.source_id)}) "
-                         f"на сумму {self.amount}, "
-                         f"к возврату {self.amount + self.reward} {self.expected_settle_date.strftime('%d.%m.%Y')} "
+                    text=f"Займ от {await self.context.db.get_legend_source_name_by_id(legend_id)}"
+                         f"({await self.context.db.get_source_name_by_id(source_id)}) "
+                         f"на сумму {amount}, "
+                         f"к возврату {amount + reward} {expected_settle_date.strftime('%d.%m.%Y')} "
                          f"успешно оформлен!",
                     reply_markup=self.get_kb()
                 )
@@ -183,33 +181,24 @@ class LoanCallbackFactory(CallbackFactory):
 
 class PaybackCallbackFactory(CallbackFactory):
     prefix: str = "payback"
-    def __init__(self, context: Context):
-        super().__init__(context)
-        self.loan_id: int | None = None
-        self.settle_date: date | None = None
-        self.amount: int | None = None
-        self.new_reward: int | None = None
-        self.new_expected_settle_date: date | None = None
-        self.deserializers: list[Callable[[str], Any]] = [
-            lambda x: int(x),
-            lambda x: datetime.strptime(x, "%Y-%m-%d").date(),
-            lambda x: int(x),
-            lambda x: int(x),
-            lambda x: datetime.strptime(x, "%Y-%m-%d").date()
-        ]
-
-    def _parse_args(self, callback_data: str) -> None:
-        (self.loan_id, self.settle_date, self.amount,
-         self.new_reward, self.new_expected_settle_date) = self._preproc(callback_data)
+    deserializers: list[Callable[[str], Any]] = [
+        lambda x: int(x),
+        lambda x: date.fromisoformat(x),
+        lambda x: int(x),
+        lambda x: int(x),
+        lambda x: date.fromisoformat(x)
+    ]
 
-    async def callback(self, callback: CallbackQuery) -> None:
-        self._parse_args(callback_data=callback.data)
-        if self.args_count == 1:
-            self.context.input_mode_callback_data = None
+    async def callback(self, callback: CallbackQuery, state: ChatState) -> None:
+        args_count, args = await self._preproc(callback.data)
+        loan_id, settle_date, amount, new_reward, new_expected_settle_date = args
+        args = args[: args_count]
+        if args_count == 1:
+            state.input_mode_callback_data = None
             builder = InlineKeyboardBuilder()
             buttons = [
                 InlineKeyboardButton(text=dt.strftime("%d.%m.%Y"),
-                                     callback_data=callback.data+f"_{dt.strftime('%Y-%m-%d')}")
+                                     callback_data=self._next(args, dt))
                 for dt in [date.today() + timedelta(days=i) for i in range(-7, 7)]
             ]
             builder.row(*buttons[: 7])
@@ -217,24 +206,24 @@ class PaybackCallbackFactory(CallbackFactory):
             builder.row(*buttons[8: ])
             await callback.message.edit_text(text="Выберите дату погашения задолженности",
                                              reply_markup=builder.as_markup())
-        elif self.args_count == 2:
-            self.context.input_mode_callback_data = None
-            amount, _ = self.context.db.get_loan_amount_and_reward(self.loan_id)
+        elif args_count == 2:
+            state.input_mode_callback_data = None
+            total, _ = await self.context.db.get_loan_amount_and_reward(loan_id)
             builder = InlineKeyboardBuilder()
             buttons = [
-                InlineKeyboardButton(text=str(i), callback_data=callback.data + f"_{i}")
+                InlineKeyboardButton(text=str(i), callback_data=self._next(args, i))
                 for i in range(5000, 30001, 5000)
             ]
-            builder.row(InlineKeyboardButton(text="Полное погашение", callback_data=callback.data+f"_{amount}"))
+            builder.row(InlineKeyboardButton(text="Полное погашение", callback_data=self._next(args, total)))
             for i in range(0, len(buttons), 2):
                 builder.row(*buttons[i: i + 2])
-            self.context.input_mode_callback_data = callback.data
+            state.input_mode_callback_data = callback.data
             await callback.message.answer(text="Выберите или введите сумму погашения", reply_markup=builder.as_markup())
-        elif self.args_count == 3:
-            self.context.input_mode_callback_data = None
-            amount, reward = self.context.db.get_loan_amount_and_reward(self.loan_id)
-            if self.amount >= amount:
-                if self.context.db.settle_loan(self.loan_id, self.settle_date):
+        elif args_count == 3:
+            state.input_mode_callback_data = None
+            total, reward = await self.context.db.get_loan_amount_and_reward(loan_id)
+            if amount >= total:
+                if await self.context.db.settle_loan(loan_id, settle_date):
                     await callback.message.answer(text=f"Кажется, займ можно закрывать, уже готово. Чистая прибыль: {reward}",
                                                   reply_markup=self.get_kb())
                 else:
@@ -243,16 +232,16 @@ class PaybackCallbackFactory(CallbackFactory):
             else:
                 builder = InlineKeyboardBuilder()
                 buttons = [
-                    InlineKeyboardButton(text=str(i), callback_data=callback.data+f"_{i}")
+                    InlineKeyboardButton(text=str(i), callback_data=self._next(args, i))
                     for i in range(5000, 30001, 5000)
                 ]
                 for i in range(0, len(buttons), 2):
                     builder.row(*buttons[i: i + 2])
-                self.context.input_mode_callback_data = callback.data
+                state.input_mode_callback_data = callback.data
                 await callback.message.edit_text(text="Выберите или введите сумму процентов за продление в рублях",
                                               reply_markup=builder.as_markup())
-        elif self.args_count == 4:
-            self.context.input_mode_callback_data = None
+        elif args_count == 4:
+            state.input_mode_callback_data = None
             builder = InlineKeyboardBuilder()
             month = date.today().month
             year = date.today().year
@@ -263,14 +252,14 @@ class PaybackCallbackFactory(CallbackFactory):
                 buttons.append(
                     InlineKeyboardButton(
                         text=dt.strftime("%d.%m.%Y"),
-                        callback_data=callback.data + f"_{dt.strftime('%Y-%m-%d')}"
+                        callback_data=self._next(args, dt)
                     )
                 )
                 dt = date(year=year, month=month, day=last_day_of_month[month])
                 buttons.append(
                     InlineKeyboardButton(
                         text=dt.strftime("%d.%m.%Y"),
-                        callback_data=callback.data + f"_{dt.strftime('%Y-%m-%d')}"
+                        callback_data=self._next(args, dt)
                     )
                 )
                 year += month // 12
@@ -279,13 +268,13 @@ class PaybackCallbackFactory(CallbackFactory):
                 builder.row(*buttons[i: i + 2])
             await callback.message.edit_text(text="Выберите дату ожидаемого погашения продления",
                                           reply_markup=builder.as_markup())
-        elif self.args_count == 5:
-            self.context.input_mode_callback_data = None
-            _, reward = self.context.db.get_loan_amount_and_reward(self.loan_id)
-            if self.context.db.settle_loan(self.loan_id, self.settle_date, self.amount,
-                                        self.new_reward, self.new_expected_settle_date):
-                await callback.message.answer(text=f"Продление займа №{self.loan_id} до "
-                                                   f"{self.new_expected_settle_date.strftime('%d.%m.%Y')} "
+        elif args_count == 5:
+            state.input_mode_callback_data = None
+            _, reward = await self.context.db.get_loan_amount_and_reward(loan_id)
+            if await self.context.db.settle_loan(loan_id, settle_date, amount,
+                                        new_reward, new_expected_settle_date):
+                await callback.message.answer(text=f"Продление займа №{loan_id} до "
+                                                   f"{new_expected_settle_date.strftime('%d.%m.%Y')} "
                                                    f"успешно выполнено (прибыль для отчёта: {reward} рублей)",
                                               reply_markup=self.get_kb())
             else:
@@ -297,71 +286,127 @@ class PaybackCallbackFactory(CallbackFactory):
         await callback.answer()
 
 
+class ScheduleCallbackFactory(CallbackFactory):
+    prefix: str = SCHEDULE_PREFIX
+    deserializers: list[Callable[[str], Any]] = [
+        lambda x: int(x)
+    ]
+
+    async def callback(self, callback: CallbackQuery, state: ChatState) -> None:
+        args_count, args = await self._preproc(callback.data)
+        page = args[0] if args_count == 1 else 0
+        text, markup = await get_schedule_page(self.context, page)
+        if text != callback.message.text:
+            await callback.message.edit_text(text=text, reply_markup=markup)
+        await callback.answer()
+
+
+# analytics period as [start, end) dates, None ends are open: "all" for the whole history, "30d" for the last days
+# up to today, or a year with an optional part, "q1".."q4" for a quarter or "1".."12" for a month,
+# -1 is kept for the whole history and the whole year of older keyboards
+def get_analytics_range(period: str, part: str | None, today: date) -> tuple[date | None, date | None]:
+    if period in ("all", "-1"):
+        return None, None
+    if period.endswith("d"):
+        return today - timedelta(days=int(period[:-1]) - 1), today + timedelta(days=1)
+    year = int(period)
+    if part is None or part in ("year", "-1"):
+        return date(year, 1, 1), date(year + 1, 1, 1)
+    if part.startswith("q"):
+        first_month, months = (int(part[1:]) - 1) * 3 + 1, 3
+    else:
+        first_month, months = int(part), 1
+    next_month = first_month + months - 1
+    return date(year, first_month, 1), date(year + next_month // 12, next_month % 12 + 1, 1)
+
+
 class AnalyticsCallbackFactory(CallbackFactory):
     prefix: str = 'analytics'
+    deserializers: list[Callable[[str], Any]] = [
+        lambda x: x,
+        lambda x: x,
+        lambda x: x
+    ]
     def __init__(self, context: Context):
         super().__init__(context)
-        self.by: str | None = None
-        self.year: int | None = None
-        self.month: int | None = None
-        self.deserializers: list[Callable[[str], Any]] = [
-            lambda x: x,
-            lambda x: int(x),
-            lambda x: int(x)
-        ]
-        self.by_to_callback = {
-            "source": lambda *x: self.context.reporter.get_graphic_by_sources('source_name', *x),
-            "legend": lambda *x: self.context.reporter.get_graphic_by_sources('legend_name', *x)
+        self.by_to_column = {
+            "source": "source_name",
+            "legend": "legend_name"
         }
 
-    def _parse_args(self, callback_data: str) -> None:
-        self.by, self.year, self.month = self._preproc(callback_data)
-
-    async def callback(self, callback: CallbackQuery) -> None:
-        self._parse_args(callback.data)
-        if self.args_count == 1:
+    async def callback(self, callback: CallbackQuery, state: ChatState) -> None:
+        args_count, args = await self._preproc(callback.data)
+        by, period, part = args
+        args = args[: args_count]
+        reporter = await self.context.get_reporter()
+        await reporter.get_movements()
+        if args_count == 1:
             builder = InlineKeyboardBuilder()
-            builder.row(InlineKeyboardButton(text="Все время наблюдений", callback_data=callback.data+"_-1"))
+            builder.row(InlineKeyboardButton(text="Все время наблюдений", callback_data=self._next(args, "all")))
+            builder.row(
+                InlineKeyboardButton(text="Последние 30 дней", callback_data=self._next(args, "30d")),
+                InlineKeyboardButton(text="Последние 90 дней", callback_data=self._next(args, "90d"))
+            )
             buttons = [
                 InlineKeyboardButton(
                     text=str(i),
-                    callback_data=callback.data+f"_{i}"
+                    callback_data=self._next(args, str(i))
                 )
                 for i in range(date.today().year - 4, date.today().year + 1)
             ]
             builder.row(*buttons)
-            await callback.message.edit_text(text="Выберите год для аналитики", reply_markup=builder.as_markup())
-        elif self.args_count == 2:
-            if self.year == -1:
-                graphics = self.by_to_callback[self.by]()
-                await callback.message.answer(text="Ожидайте графики следующим сообщением", reply_markup=self.get_kb())
-                await callback.message.answer_media_group(media=self._get_group_for_sending_graphics(graphics))
+            await callback.message.edit_text(text="Выберите период для аналитики", reply_markup=builder.as_markup())
+        elif args_count == 2 and period.isdigit():
+            builder = InlineKeyboardBuilder()
+            builder.row(InlineKeyboardButton(text="Весь год", callback_data=self._next(args, "year")))
+            builder.row(*(
+                InlineKeyboardButton(text=f"{i} кв.", callback_data=self._next(args, f"q{i}"))
+                for i in range(1, 5)
+            ))
+            buttons = [
+                InlineKeyboardButton(
+                    text=str(i),
+                    callback_data=self._next(args, str(i))
+                )
+                for i in range(1, 13)
+            ]
+            builder.row(*buttons)
+            await callback.message.edit_text(text="Выберите квартал или месяц для аналитики", reply_markup=builder.as_markup())
+        elif args_count in (2, 3) and by in self.by_to_column:
+            start, end = get_analytics_range(period, part, date.today())
+            graphics = await reporter.get_graphic_by_sources(self.by_to_column[by], start, end)
+            if not graphics:
+                await callback.message.answer(text="За выбранный период движений нет", reply_markup=self.get_kb())
             else:
-                builder = InlineKeyboardBuilder()
-                builder.row(InlineKeyboardButton(text="Весь год", callback_data=callback.data + "_-1"))
-                buttons = [
-                    InlineKeyboardButton(
-                        text=str(i),
-                        callback_data=callback.data + f"_{i}"
-                    )
-                    for i in range(1, 13)
-                ]
-                builder.row(*buttons)
-                await callback.message.edit_text(text="Выберите месяц для аналитики", reply_markup=builder.as_markup())
-        elif self.args_count == 3:
-            graphics = self.by_to_callback[self.by](self.year, self.month if self.month > -1 else None)
-            await callback.message.answer(text="Ожидайте графики следующим сообщением", reply_markup=self.get_kb())
-            await callback.message.answer_media_group(media=self._get_group_for_sending_graphics(graphics))
-        elif self.args_count == 4:
-            if self.month == -1:
-                self.month = None
-            graphics = self.by_to_callback[self.by](self.year, self.month)
-            await callback.message.answer(text="Ожидайте фото следующим сообщением", reply_markup=self.get_kb())
-            await callback.message.answer_media_group(media=self._get_group_for_sending_graphics(graphics))
+                await callback.message.answer(text="Ожидайте графики следующим сообщением", reply_markup=self.get_kb())
+                await self._send_graphics(callback, graphics)
+        else:
+            logging.error(f"An error occurred while processing callback for {callback.data} in {self.__class__.__name__}")
+            await callback.message.answer(text="Что-то не то...", reply_markup=self.get_kb())
         await callback.answer()
 
-    def _get_group_for_sending_graphics(self, graphics: list[str]) -> list[InputMediaPhoto]:
+    # telegram takes from 2 to 10 photos in a media group, so legends are sent in groups of balanced sizes,
+    # 11 charts go as 6 and 5 instead of 10 and a single one, a lone chart is sent as a photo
+    async def _send_graphics(self, callback: CallbackQuery, graphics: list[Chart]) -> None:
+        if len(graphics) == 1:
+            g = graphics[0]
+            message = await callback.message.answer_photo(
+                photo=g.file_id or BufferedInputFile(g.data, filename=g.filename), caption="Графики подъехали"
+            )
+            if message.photo:
+                g.file_id = message.photo[-1].file_id
+            return
+        groups = -(-len(graphics) // MEDIA_GROUP_SIZE)
+        bounds = [len(graphics) * i // groups for i in range(groups + 1)]
+        for start, end in zip(bounds, bounds[1:]):
+            group = graphics[start: end]
+            messages = await callback.message.answer_media_group(media=self._get_group_for_sending_graphics(group))
+            for g, message in zip(group, messages):
+                if message.photo:
+                    g.file_id = message.photo[-1].file_id
+
+    def _get_group_for_sending_graphics(self, graphics: list[Chart]) -> list[InputMediaPhoto]:
         builder = MediaGroupBuilder(caption="Графики подъехали")
         for g in graphics:
-            builder.add(type="photo", media=FSInputFile(g))
+            builder.add(type="photo", media=g.file_id or BufferedInputFile(g.data, filename=g.filename))
         return builder.build()
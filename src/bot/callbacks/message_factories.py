@@ -1,19 +1,23 @@
 import logging
+import os
+import tempfile
 from abc import ABC, abstractmethod
 from traceback import format_exc
-from datetime import datetime, date
-from collections import defaultdict
+from datetime import date
 
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, Message, InlineKeyboardButton
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, Message, InlineKeyboardButton, InlineKeyboardMarkup, \
+    FSInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from src.bot.callbacks.schedule import get_schedule_page
+from src.context.chat_state import ChatState
 from src.context.context import Context
+from src.utils.loans_io import FIELDS, get_format
 
 class MessageFactory(ABC):
     alias: str = 'unknown'
     def __init__(self, context: Context):
         self.context = context
-        self.step: int = 0
         self.mod: int = 1
 
     def get_kb(self) -> ReplyKeyboardMarkup:
@@ -22,37 +26,38 @@ class MessageFactory(ABC):
         return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True, one_time_keyboard=False)
 
     @abstractmethod
-    async def callback(self, message: Message) -> None:
+    async def callback(self, message: Message, state: ChatState) -> None:
         pass
 
 class InputMessageFactory(MessageFactory):
     alias: str = 'ANY'
-    async def callback(self, message: Message) -> None:
+    async def callback(self, message: Message, state: ChatState) -> None:
+        callback_data = await self.context.callbacks.append(state.input_mode_callback_data, message.text)
+        if callback_data is None:
+            await message.answer(text="Не получилось разобрать значение, попробуйте ещё раз", reply_markup=self.get_kb())
+            return
         await message.answer(text="Значение принято!", reply_markup=self.get_kb())
         builder = InlineKeyboardBuilder()
-        builder.row(InlineKeyboardButton(text="Отмена", callback_data=self.context.input_mode_callback_data))
-        self.context.input_mode_callback_data += "_" + message.text
-        builder.row(InlineKeyboardButton(text="Продолжить", callback_data=self.context.input_mode_callback_data))
+        builder.row(InlineKeyboardButton(text="Отмена", callback_data=state.input_mode_callback_data))
+        builder.row(InlineKeyboardButton(text="Продолжить", callback_data=callback_data))
         await message.answer(text="Продолжить?", reply_markup=builder.as_markup())
-        self.context.input_mode_callback_data = None
+        state.input_mode_callback_data = None
 
 class CommentMessageFactory(MessageFactory):
     alias: str = 'comment'
     def __init__(self, context: Context):
         super().__init__(context)
         self.mod = 3
-        self.loan_id: int | None = None
-        self.comment: str | None = None
 
-    async def callback(self, message: Message) -> None:
-        if self.step == 0:
+    async def callback(self, message: Message, state: ChatState) -> None:
+        if state.step == 0:
             text = ""
             buttons = []
             for (loan_id, source_id, source_name, loan_date, expected_settle_date,
-                 amount, total, legend_id, legend_name, comment) in self.context.db.get_unsettled_loans():
+                 amount, total, legend_id, legend_name, comment) in await self.context.db.get_unsettled_loans():
                 text += (f"{loan_id}. {legend_name}({source_name}) -- {amount} -> {total} -- "
-                         f"{datetime.strptime(loan_date, '%Y-%m-%d').strftime('%d.%m.%Y')} -> "
-                         f"{datetime.strptime(expected_settle_date, '%Y-%m-%d').strftime('%d.%m.%Y')}\n")
+                         f"{loan_date.strftime('%d.%m.%Y')} -> "
+                         f"{expected_settle_date.strftime('%d.%m.%Y')}\n")
                 buttons.append(KeyboardButton(text=str(loan_id)))
             special_keyboard = ReplyKeyboardMarkup(
                 keyboard=[buttons[i: i+3] for i in range(0, len(buttons), 3)],
@@ -62,22 +67,21 @@ class CommentMessageFactory(MessageFactory):
                 text="Введите номер займа для добавления комментария:\n"+text,
                 reply_markup=special_keyboard
             )
-            self.context.input_mode_message_alias = self.alias
-        elif self.step == 1:
+            state.input_mode_message_alias = self.alias
+        elif state.step == 1:
             try:
-                self.loan_id = int(message.text)
+                state.loan_id = int(message.text)
             except:
                 logging.error("Error while parsing loan_id for adding comment")
                 logging.error(format_exc())
                 return
             await message.answer(text="Введите комментарий к займу", reply_markup=self.get_kb())
-        elif self.step == 2:
-            self.comment = message.text
-            if self.context.db.update_loan_comment(self.loan_id, self.comment):
+        elif state.step == 2:
+            if await self.context.db.update_loan_comment(state.loan_id, message.text):
                 await message.answer(text="Отлично! Комментарий добавлен", reply_markup=self.get_kb())
             else:
                 await message.answer(text="Какая-то ошибка", reply_markup=self.get_kb())
-        self.step = (self.step + 1) % self.mod
+        state.step = (state.step + 1) % self.mod
 
 
 class SourceMessageFactory(MessageFactory):
@@ -86,18 +90,18 @@ class SourceMessageFactory(MessageFactory):
         super().__init__(context=context)
         self.mod = 2
 
-    async def callback(self, message: Message) -> None:
-        if self.step == 0:
+    async def callback(self, message: Message, state: ChatState) -> None:
+        if state.step == 0:
             await message.answer(text="Введите имя нового источника", reply_markup=self.get_kb())
-            self.context.input_mode_message_alias = self.alias
-        elif self.step == 1:
-            if not self.context.db.add_source(message.text):
+            state.input_mode_message_alias = self.alias
+        elif state.step == 1:
+            if not await self.context.db.add_source(message.text):
                 await message.answer(text="Что-то при добавлении пошло не так", reply_markup=self.get_kb())
             else:
                 await message.answer(text="Источник успешно добавлен", reply_markup=self.get_kb())
-            self.context.input_mode_message_alias = None
-        self.step += 1
-        self.step %= self.mod
+            state.input_mode_message_alias = None
+        state.step += 1
+        state.step %= self.mod
 
 
 class LegendMessageFactory(MessageFactory):
@@ -106,31 +110,31 @@ class LegendMessageFactory(MessageFactory):
         super().__init__(context=context)
         self.mod = 2
 
-    async def callback(self, message: Message) -> None:
-        if self.step == 0:
+    async def callback(self, message: Message, state: ChatState) -> None:
+        if state.step == 0:
             await message.answer(text="Введите имя новой легенды", reply_markup=self.get_kb())
-            self.context.input_mode_message_alias = self.alias
-        elif self.step == 1:
-            if not self.context.db.add_legend_source(message.text):
+            state.input_mode_message_alias = self.alias
+        elif state.step == 1:
+            if not await self.context.db.add_legend_source(message.text):
                 await message.answer(text="Что-то при добавлении пошло не так", reply_markup=self.get_kb())
             else:
                 await message.answer(text="Легенда успешно добавлена", reply_markup=self.get_kb())
-            self.context.input_mode_message_alias = None
-        self.step += 1
-        self.step %= self.mod
+            state.input_mode_message_alias = None
+        state.step += 1
+        state.step %= self.mod
 
 
 class PaybackMessageFactory(MessageFactory):
     alias: str = 'payback'
-    async def callback(self, message: Message) -> None:
+    async def callback(self, message: Message, state: ChatState) -> None:
         builder = InlineKeyboardBuilder()
         buttons = [InlineKeyboardButton(
             text=f"{total} ({legend_name}) до "
-                 f"{datetime.strptime(expected_settle_date, '%Y-%m-%d').strftime('%d.%m.%Y')}",
-            callback_data=f"payback_{loan_id}"
+                 f"{expected_settle_date.strftime('%d.%m.%Y')}",
+            callback_data=self.context.callbacks.encode("payback", [loan_id])
         )
             for loan_id, source_id, source_name, loan_date, expected_settle_date,
-            amount, total, legend_id, legend_name, comment in self.context.db.get_unsettled_loans()]
+            amount, total, legend_id, legend_name, comment in await self.context.db.get_unsettled_loans()]
         for but in buttons:
             builder.row(but)
         await message.answer(text="Выберите займ для погашения", reply_markup=builder.as_markup())
@@ -138,71 +142,78 @@ class PaybackMessageFactory(MessageFactory):
 
 class LoanMessageFactory(MessageFactory):
     alias: str = 'loan'
-    async def callback(self, message: Message) -> None:
-        builder = InlineKeyboardBuilder()
-        buttons = [InlineKeyboardButton(text=source_name, callback_data=f"loan_{source_id}")
-                   for source_id, source_name in self.context.db.get_sources()]
-        for but in buttons:
-            builder.row(but)
-        await message.answer(text="Выберите РЕАЛЬНЫЙ источник", reply_markup=builder.as_markup())
+    def __init__(self, context: Context):
+        super().__init__(context)
+        self.keyboard: InlineKeyboardMarkup | None = None
+        self.keyboard_version: int = -1
+
+    async def callback(self, message: Message, state: ChatState) -> None:
+        if self.keyboard_version != self.context.db.dimensions_version:
+            self.keyboard_version = self.context.db.dimensions_version
+            builder = InlineKeyboardBuilder()
+            buttons = [InlineKeyboardButton(text=source_name,
+                                            callback_data=self.context.callbacks.encode("loan", [source_id], pinned=True))
+                       for source_id, source_name in await self.context.db.get_sources()]
+            for but in buttons:
+                builder.row(but)
+            self.keyboard = builder.as_markup()
+        await message.answer(text="Выберите РЕАЛЬНЫЙ источник", reply_markup=self.keyboard)
 
 
 class ScheduleMessageFactory(MessageFactory):
     alias: str = 'schedule'
-    async def callback(self, message: Message) -> None:
-        date_to_total = defaultdict(int)
-        date_to_list = defaultdict(list[str])
-        all_total = 0
-        for i, (loan_id, source_id, source_name, loan_date, expected_settle_date,
-            amount, total, legend_id, legend_name, comment) in enumerate(self.context.db.get_unsettled_loans()):
-            expected_settle_date = datetime.strptime(expected_settle_date, '%Y-%m-%d')
-            date_to_total[expected_settle_date] += total
-            all_total += total
-            l = len(date_to_list[expected_settle_date])
-            date_to_list[expected_settle_date].append(f"{l + 1}. {total} "
-                                                      f"от {datetime.strptime(loan_date, '%Y-%m-%d').strftime('%d.%m')} ({legend_name})")
-            
-        
-        text = f"Всего к возврату: {all_total}\n"
-        for dt, total in date_to_total.items():
-            loans = "\n".join(date_to_list[dt])
-            text += f"{dt.strftime('%d.%m')}: {total}:\n{loans}\n\n"
-        await message.answer(text=text)
-
-        text = ""
-        prev_date: date | None = None
-        all_total = 0
-        all_amounts = 0
-        day_total = 0
-        for i, (loan_id, source_id, source_name, loan_date, expected_settle_date,
-            amount, total, legend_id, legend_name, comment) in enumerate(self.context.db.get_unsettled_loans()):
-            expected_settle_date = datetime.strptime(expected_settle_date, '%Y-%m-%d')
-            if prev_date != expected_settle_date:
-                if prev_date is not None:
-                    text += f"\n{prev_date.strftime('%d.%m')}: {day_total} рублей\n\n"
-                prev_date = expected_settle_date
-                day_total = 0
-            text += (f"{i + 1}. {amount} -> {total} по займу от {datetime.strptime(loan_date, '%Y-%m-%d').strftime('%d.%m')} "
-                     f"({legend_name}) - '{comment if comment is not None else str()}' ({source_name})\n")
-            all_total += total
-            all_amounts += amount
-            day_total += total
-        if prev_date is not None:
-            text += f"\n{prev_date.strftime('%d.%m')}: {day_total} рублей\n\n"
-        text += f"Итого: {all_amounts} -> {all_total} рублей ({all_total - all_amounts} чистыми)"
-        await message.answer(text=text, reply_markup=self.get_kb())
+    async def callback(self, message: Message, state: ChatState) -> None:
+        text, markup = await get_schedule_page(self.context, 0)
+        await message.answer(text=text, reply_markup=markup or self.get_kb())
 
 
 class AnalyticsMessageFactory(MessageFactory):
     alias: str = 'analytics'
-    async def callback(self, message: Message) -> None:
+    async def callback(self, message: Message, state: ChatState) -> None:
         builder = InlineKeyboardBuilder()
         builder.row(InlineKeyboardButton(
             text="Динамика позиции по источникам",
-            callback_data=self.alias+"_source"
+            callback_data=self.context.callbacks.encode(self.alias, ["source"], pinned=True)
         ))
         builder.row(InlineKeyboardButton(
             text="Динамика позиции по легендам",
-            callback_data=self.alias+"_legend"
+            callback_data=self.context.callbacks.encode(self.alias, ["legend"], pinned=True)
         ))
         await message.answer(text="Какая аналитика вас интересует?", reply_markup=builder.as_markup())
+
+
+class ImportMessageFactory(MessageFactory):
+    alias: str = 'import'
+    async def callback(self, message: Message, state: ChatState) -> None:
+        if message.document is None:
+            await message.answer(
+                text=f"Отправьте файл .csv или .jsonl с полями {', '.join(FIELDS)}. "
+                     f"Источники и легенды должны уже существовать, даты в формате ГГГГ-ММ-ДД",
+                reply_markup=self.get_kb()
+            )
+            return
+        file_format = get_format(message.document.file_name or "")
+        if file_format is None:
+            await message.answer(text="Поддерживаются только файлы .csv и .jsonl", reply_markup=self.get_kb())
+            return
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, f"loans.{file_format}")
+            await message.bot.download(message.document, destination=path)
+            count, errors = await self.context.transfer.import_file(path, file_format)
+        if errors:
+            await message.answer(text="Займы не импортированы:\n" + "\n".join(errors), reply_markup=self.get_kb())
+        else:
+            await message.answer(text=f"Импортировано займов: {count}", reply_markup=self.get_kb())
+
+
+class ExportMessageFactory(MessageFactory):
+    alias: str = 'export'
+    async def callback(self, message: Message, state: ChatState) -> None:
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "loans.csv")
+            count = await self.context.transfer.export_file(path, "csv")
+            await message.answer_document(
+                document=FSInputFile(path, filename=f"loans_{date.today().strftime('%Y%m%d')}.csv"),
+                caption=f"Выгружено займов: {count}",
+                reply_markup=self.get_kb()
+            )
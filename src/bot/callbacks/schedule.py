@@ -0,0 +1,47 @@
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from src.context.context import Context
+
+SCHEDULE_PREFIX = "schedule"
+MAX_COMMENT_LENGTH = 64
+
+
+# renders one page of the payment schedule, only the loans of this page are read from the db
+async def get_schedule_page(context: Context, page: int) -> tuple[str, InlineKeyboardMarkup | None]:
+    loans_count, all_amounts, all_total = await context.db.get_schedule_summary()
+    page_size = context.SCHEDULE_PAGE_SIZE
+    pages = max(1, (loans_count + page_size - 1) // page_size)
+    page = min(max(page, 0), pages - 1)
+
+    text = f"Всего к возврату: {all_total} ({loans_count} займов)\n\n"
+    i = page * page_size
+    for dt, day_total, day_count, loans in await context.db.get_schedule_page(page * page_size, page_size):
+        text += f"{dt.strftime('%d.%m')}: {day_total} рублей ({day_count} займов)\n"
+        for loan_date, amount, total, legend_name, comment, source_name in loans:
+            i += 1
+            comment = comment if comment is not None else str()
+            if len(comment) > MAX_COMMENT_LENGTH:
+                comment = comment[: MAX_COMMENT_LENGTH - 1] + "…"
+            text += (f"{i}. {amount} -> {total} по займу от {loan_date.strftime('%d.%m')} "
+                     f"({legend_name}) - '{comment}' ({source_name})\n")
+        text += "\n"
+    text += f"Итого: {all_amounts} -> {all_total} рублей ({all_total - all_amounts} чистыми)"
+    if pages == 1:
+        return text, None
+    text += f"\nСтраница {page + 1} из {pages}"
+
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(
+            text="< Назад",
+            callback_data=context.callbacks.encode(SCHEDULE_PREFIX, [page - 1])
+        ))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton(
+            text="Вперёд >",
+            callback_data=context.callbacks.encode(SCHEDULE_PREFIX, [page + 1])
+        ))
+    builder = InlineKeyboardBuilder()
+    builder.row(*buttons)
+    return text, builder.as_markup()
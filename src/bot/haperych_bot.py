@@ -1,12 +1,15 @@
 import asyncio
 import logging
+import time
+from typing import Any, Awaitable, Callable
 
-from aiogram import Bot, Dispatcher
+from aiogram import Bot, Dispatcher, F
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from aiogram.filters import CommandStart
-from aiogram.types import Message, CallbackQuery
+from aiogram.filters import Command, CommandStart
+from aiogram.types import Message, CallbackQuery, TelegramObject
 
+from src.bot.callbacks.message_factories import ImportMessageFactory
 from src.bot.factory_helper import CallbackHelper
 from src.context.context import Context
 
@@ -18,31 +21,114 @@ class HaperychBot:
         self.dp = Dispatcher()
         self.bot = Bot(token=context.BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 
+        self.metrics_task: asyncio.Task | None = None
+        self.warm_up_task: asyncio.Task | None = None
+        self.dp.message.middleware(self._measure)
+        self.dp.callback_query.middleware(self._measure)
+
+        @self.dp.startup()
+        async def on_startup() -> None:
+            await self.context.callbacks.load()
+            if self.context.METRICS_FILE:
+                self.metrics_task = asyncio.create_task(self.context.metrics.dump_periodically(
+                    self.context.METRICS_FILE, self.context.METRICS_DUMP_INTERVAL
+                ))
+            if self.context.REPORTER_WARM_UP:
+                self.warm_up_task = asyncio.create_task(self.context.warm_up())
+
+        @self.dp.shutdown()
+        async def on_shutdown() -> None:
+            if self.warm_up_task is not None:
+                self.warm_up_task.cancel()
+            if self.metrics_task is not None:
+                self.metrics_task.cancel()
+                self.context.metrics.dump(self.context.METRICS_FILE)
+
+        @self.dp.message(Command("stats"))
+        async def stats_handler(message: Message) -> None:
+            if message.chat.id != self.context.ADMIN_ID:
+                return
+            await message.answer(text=self.context.metrics.get_summary()[: 4096])
+
         @self.dp.message(CommandStart())
         async def command_start_handler(message: Message) -> None:
             logging.info(f"Message from {message.chat.id}")
             if not self.check_rights(message):
                 return
-            await self.helper.default_message_factory.callback(message)
+            async with self.context.states.lock(message.chat.id):
+                state = await self.context.states.get(message.chat.id)
+                await self.helper.default_message_factory.callback(message, state)
+                await self.context.states.save(state)
+                await self.context.callbacks.flush()
+
+        @self.dp.message(F.document)
+        async def document_handler(message: Message) -> None:
+            if not self.check_rights(message):
+                return
+            async with self.context.states.lock(message.chat.id):
+                state = await self.context.states.get(message.chat.id)
+                await self.helper.alias_to_factory[ImportMessageFactory.alias].callback(message, state)
+                await self.context.states.save(state)
+                await self.context.callbacks.flush()
 
         @self.dp.message()
         async def message_handler(message: Message) -> None:
             if not self.check_rights(message):
                 return
-            f = self.helper.get_message_callback(message.text)
-            if f is not None:
-                await f(message)
+            async with self.context.states.lock(message.chat.id):
+                state = await self.context.states.get(message.chat.id)
+                f = self.helper.get_message_callback(message.text, state)
+                if f is not None:
+                    await f(message, state)
+                await self.context.states.save(state)
+                await self.context.callbacks.flush()
 
         @self.dp.callback_query()
         async def callback_handler(callback: CallbackQuery):
             if not self.check_rights(callback.message):
                 return
-            f = self.helper.get_callback_factory(callback.data).callback
-            if f is not None:
-                await f(callback)
+            async with self.context.states.lock(callback.message.chat.id):
+                state = await self.context.states.get(callback.message.chat.id)
+                f = self.helper.get_callback_factory(callback.data).callback
+                if f is not None:
+                    await f(callback, state)
+                await self.context.states.save(state)
+                await self.context.callbacks.flush()
+
+    # times every handler, routes are the factory aliases and callback prefixes so their number stays small
+    async def _measure(
+            self,
+            handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any]) -> Any:
+        if isinstance(event, CallbackQuery):
+            name, route = "callback", (event.data or "").split("_")[0]
+            if route not in self.helper.prefix_to_callback_factory:
+                route = "unknown"
+        elif event.document is not None:
+            name, route = "document", "import"
+        elif event.text is not None and event.text.startswith("/"):
+            name, route = "command", (event.text[1:].split() or [""])[0].split("@")[0]
+            if route not in ("start", "stats"):
+                route = "unknown"
+        else:
+            name, route = "message", self.context.BUTTON_TO_ALIAS.get(event.text, "input")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.context.metrics.inc("handler_errors_total", handler=name, route=route)
+            raise
+        finally:
+            self.context.metrics.observe("handler_seconds", time.perf_counter() - started, handler=name, route=route)
 
     def check_rights(self, msg: Message) -> bool:
-        return msg.chat.id == self.context.ADMIN_ID
+        return msg.chat.id in self.context.ALLOWED_CHAT_IDS
 
     def run(self):
-        asyncio.run(self.dp.start_polling(self.bot))
+        try:
+            # updates of different chats are processed concurrently, the ones of a single chat wait for its lock
+            asyncio.run(self.dp.start_polling(self.bot, handle_as_tasks=True))
+        finally:
+            self.context.renderer.close()
+            self.context.db.close()
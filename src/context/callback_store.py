@@ -0,0 +1,133 @@
+import json
+import logging
+import time
+from traceback import format_exc
+from typing import Any, Callable
+
+from src.utils.db import Db
+from src.utils.utils import encode, decode
+
+# tokens start with a character that callback data of the buttons with inline args never had,
+# so a button left in a chat from those versions cannot be taken for a payload id
+TOKEN_MARKER = "."
+# ids fit into 8 bytes, which are 11 characters of base64, plus the marker
+MAX_TOKEN_LENGTH = 12
+
+
+class CallbackStore:
+    def __init__(self, db: Db, ttl: float):
+        self.db = db
+        self.ttl = ttl
+        self.next_id: int = 1
+        # payload id -> (prefix, typed args, expiration time or None for pinned payloads)
+        self.payloads: dict[int, tuple[str, tuple, float | None]] = dict()
+        self.ids: dict[tuple[str, tuple], int] = dict()
+        self.deserializers: dict[str, list[Callable[[str], Any]]] = dict()
+        self.unsaved: set[int] = set()
+        self.last_eviction: float = 0.
+
+    def register(self, prefix: str, deserializers: list[Callable[[str], Any]]) -> None:
+        self.deserializers[prefix] = deserializers
+
+    # pinned payloads never expire, so their keyboards reuse them after a restart instead of storing new ones
+    async def load(self) -> None:
+        self.next_id = max(self.next_id, await self.db.get_max_callback_payload_id() + 1)
+        for payload_id, prefix, raw_args in await self.db.get_pinned_callback_payloads():
+            self._restore_payload(payload_id, prefix, raw_args, None)
+
+    # returns callback data for a button, equal payloads share the same token
+    def encode(self, prefix: str, args: list, pinned: bool = False) -> str:
+        args = tuple(args)
+        expires_at = None if pinned else time.time() + self.ttl
+        payload_id = self.ids.get((prefix, args))
+        if payload_id is None:
+            payload_id = self.next_id
+            self.next_id += 1
+            self.ids[(prefix, args)] = payload_id
+        else:
+            old_expires_at = self.payloads[payload_id][2]
+            if old_expires_at is None or (expires_at is not None and old_expires_at > expires_at - self.ttl / 2):
+                return f"{prefix}_{TOKEN_MARKER}{encode(payload_id)}"
+        self.payloads[payload_id] = (prefix, args, expires_at)
+        self.unsaved.add(payload_id)
+        return f"{prefix}_{TOKEN_MARKER}{encode(payload_id)}"
+
+    async def decode(self, callback_data: str) -> list | None:
+        try:
+            prefix, token = callback_data.split('_', 1)
+            if not token.startswith(TOKEN_MARKER) or len(token) > MAX_TOKEN_LENGTH:
+                raise ValueError("not a payload token")
+            payload_id = decode(token[len(TOKEN_MARKER):])
+        except Exception as err:
+            logging.warning(f"Error {err} while decoding callback data {callback_data}")
+            return None
+        # ids are given out in order, so a bigger one was never stored
+        if not 0 < payload_id < self.next_id:
+            logging.warning(f"Unknown payload id {payload_id} in callback data {callback_data}")
+            return None
+        payload = self.payloads.get(payload_id)
+        self.db.metrics.inc("cache_requests_total", cache="callback_payloads", result="hit" if payload is not None else "miss")
+        if payload is None:
+            try:
+                payload = await self._load_payload(payload_id)
+            except Exception:
+                logging.warning(f"Cannot load callback payload {payload_id}")
+                logging.warning(format_exc())
+                return None
+        if payload is None or payload[0] != prefix:
+            return None
+        if payload[2] is not None and payload[2] < time.time():
+            return None
+        return list(payload[1])
+
+    # deserializes a value typed by the user as the next argument of the payload
+    async def append(self, callback_data: str, value: str) -> str | None:
+        args = await self.decode(callback_data)
+        prefix = callback_data.split('_', 1)[0]
+        deserializers = self.deserializers.get(prefix, [])
+        if args is None or len(args) >= len(deserializers):
+            return None
+        try:
+            args.append(deserializers[len(args)](value))
+        except Exception as err:
+            logging.warning(f"Error {err} while processing {value} for {callback_data}")
+            return None
+        return self.encode(prefix, args)
+
+    async def flush(self) -> None:
+        now = time.time()
+        if self.unsaved:
+            payloads = []
+            for payload_id in self.unsaved:
+                prefix, args, expires_at = self.payloads[payload_id]
+                payloads.append((payload_id, prefix, json.dumps(args, default=str), expires_at))
+            self.unsaved.clear()
+            await self.db.save_callback_payloads(payloads)
+        if now - self.last_eviction >= min(self.ttl, 60.):
+            self.last_eviction = now
+            for payload_id, (prefix, args, expires_at) in list(self.payloads.items()):
+                if expires_at is not None and expires_at < now:
+                    del self.payloads[payload_id]
+                    if self.ids.get((prefix, args)) == payload_id:
+                        del self.ids[(prefix, args)]
+            await self.db.delete_callback_payloads(now)
+
+    async def _load_payload(self, payload_id: int) -> tuple[str, tuple, float | None] | None:
+        row = await self.db.get_callback_payload(payload_id)
+        if row is None:
+            return None
+        return self._restore_payload(payload_id, *row)
+
+    def _restore_payload(self, payload_id: int, prefix: str, raw_args: str, expires_at: float | None) -> tuple[str, tuple, float | None] | None:
+        try:
+            args = tuple(
+                deserializer(str(arg))
+                for arg, deserializer in zip(json.loads(raw_args), self.deserializers.get(prefix, []))
+            )
+        except Exception:
+            logging.warning(f"Cannot restore callback payload {payload_id}")
+            logging.warning(format_exc())
+            return None
+        self.payloads[payload_id] = (prefix, args, expires_at)
+        self.ids.setdefault((prefix, args), payload_id)
+        return self.payloads[payload_id]
@@ -0,0 +1,72 @@
+import asyncio
+import json
+import time
+
+from src.utils.db import Db
+
+
+class ChatState:
+    def __init__(self, chat_id: int, data: dict | None = None):
+        data = data or dict()
+        self.chat_id = chat_id
+        self.input_mode_callback_data: str | None = data.get("input_mode_callback_data")
+        self.input_mode_message_alias: str | None = data.get("input_mode_message_alias")
+        self.step: int = data.get("step", 0)
+        self.loan_id: int | None = data.get("loan_id")
+
+    def dumps(self) -> str:
+        return json.dumps({
+            "input_mode_callback_data": self.input_mode_callback_data,
+            "input_mode_message_alias": self.input_mode_message_alias,
+            "step": self.step,
+            "loan_id": self.loan_id
+        })
+
+
+class ChatStateStore:
+    def __init__(self, db: Db, ttl: float):
+        self.db = db
+        self.ttl = ttl
+        # chat id -> (state, its last persisted dump, last access time)
+        self.states: dict[int, tuple[ChatState, str, float]] = dict()
+        self.locks: dict[int, asyncio.Lock] = dict()
+        self.last_eviction: float = 0.
+
+    def lock(self, chat_id: int) -> asyncio.Lock:
+        if chat_id not in self.locks:
+            self.locks[chat_id] = asyncio.Lock()
+        return self.locks[chat_id]
+
+    async def get(self, chat_id: int) -> ChatState:
+        now = time.time()
+        await self._evict(now)
+        if chat_id in self.states:
+            self.db.metrics.inc("cache_requests_total", cache="chat_states", result="hit")
+            state, dump, _ = self.states[chat_id]
+            self.states[chat_id] = (state, dump, now)
+            return state
+        self.db.metrics.inc("cache_requests_total", cache="chat_states", result="miss")
+        state, dump = ChatState(chat_id), ""
+        row = await self.db.get_chat_state(chat_id)
+        if row is not None and row[1] >= now - self.ttl:
+            dump = row[0]
+            state = ChatState(chat_id, json.loads(dump))
+        self.states[chat_id] = (state, dump, now)
+        return state
+
+    async def save(self, state: ChatState) -> None:
+        dump = state.dumps()
+        now = time.time()
+        if self.states.get(state.chat_id, (None, "", 0.))[1] != dump:
+            await self.db.save_chat_state(state.chat_id, dump, now)
+        self.states[state.chat_id] = (state, dump, now)
+
+    async def _evict(self, now: float) -> None:
+        if now - self.last_eviction < min(self.ttl, 60.):
+            return
+        self.last_eviction = now
+        for chat_id, (_, _, accessed_at) in list(self.states.items()):
+            if accessed_at < now - self.ttl and not self.lock(chat_id).locked():
+                del self.states[chat_id]
+                del self.locks[chat_id]
+        await self.db.delete_chat_states(now - self.ttl)
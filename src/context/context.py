@@ -1,9 +1,29 @@
+import asyncio
+import importlib
 import json
 import logging
 import os
+from traceback import format_exc
+from typing import TYPE_CHECKING
 
-from src.utils.db import Db
-from src.utils.reports import Reporter
+from src.context.callback_store import CallbackStore
+from src.context.chat_state import ChatStateStore
+from src.utils.chart_cache import ChartCache
+from src.utils.charts import CHART_FORMATS, ChartRenderer
+from src.utils.db import JOURNAL_MODES, SYNCHRONOUS_LEVELS, Db
+from src.utils.loans_io import LoansTransfer
+from src.utils.metrics import Metrics
+
+# the reporter pulls pandas in, it is imported on the first use of analytics or by the warm up
+if TYPE_CHECKING:
+    from src.utils.reports import Reporter
+    from src.utils.sql_reports import SqlReporter
+
+# module and class of every reporter backend, the sql one does not need pandas at all
+REPORTER_BACKENDS: dict[str, tuple[str, str]] = {
+    "pandas": ("src.utils.reports", "Reporter"),
+    "sql": ("src.utils.sql_reports", "SqlReporter"),
+}
 
 
 class Context:
@@ -14,6 +34,13 @@ class Context:
             self.ADMIN_ID = int(os.getenv('ADMIN_ID', ""))
         except ValueError:
             logging.error("Cannot read admin id from env vars ADNIN_ID = '{}'".format(os.getenv('ADMIN_ID', "")))
+        self.ALLOWED_CHAT_IDS: set[int] = {self.ADMIN_ID}
+        for chat_id in os.getenv('ALLOWED_CHAT_IDS', "").split(','):
+            try:
+                if chat_id.strip():
+                    self.ALLOWED_CHAT_IDS.add(int(chat_id))
+            except ValueError:
+                logging.error(f"Cannot read chat id '{chat_id}' from env var ALLOWED_CHAT_IDS")
         self.DB_FILE: str = '/db_data/db.db'
         self.CONFIG_FILE = '/config/config.json'
         self.MIGRATIONS_FOLDER: str = '/migrations'
@@ -28,9 +55,85 @@ class Context:
         self.BUTTON_TO_ALIAS: dict[str ,str] = data.get("buttons_to_factory", dict())
         self.DEFAULT_MESSAGE_FACTORY_ALIAS = data.get("default_message_factory_alias", "payback")
 
-        self.db: Db = Db(self.DB_FILE, self.MIGRATIONS_FOLDER)
-        self.reporter: Reporter = Reporter(self.db.conn)
-        self.rebuild_reporter_movements: bool = True
+        self.DB_READERS_COUNT: int = data.get("db_readers_count", 4)
+        self.DB_JOURNAL_MODE: str = data.get("db_journal_mode", "wal")
+        if self.DB_JOURNAL_MODE not in JOURNAL_MODES:
+            logging.error(f"Unknown journal mode '{self.DB_JOURNAL_MODE}', wal is used instead")
+            self.DB_JOURNAL_MODE = "wal"
+        self.DB_SYNCHRONOUS: str = data.get("db_synchronous", "full")
+        if self.DB_SYNCHRONOUS not in SYNCHRONOUS_LEVELS:
+            logging.error(f"Unknown synchronous level '{self.DB_SYNCHRONOUS}', full is used instead")
+            self.DB_SYNCHRONOUS = "full"
+        self.DB_CACHE_SIZE_KB: int = data.get("db_cache_size_kb", 2000)
+        self.DB_CACHED_STATEMENTS: int = data.get("db_cached_statements", 128)
+        self.CHAT_STATE_TTL: float = data.get("chat_state_ttl_minutes", 60) * 60.
+        self.CALLBACK_TTL: float = data.get("callback_ttl_minutes", 24 * 60) * 60.
+        self.CHART_WORKERS: int | None = data.get("chart_workers")
+        self.CHART_WORKER_MAX_RSS: int | None = None
+        if data.get("chart_worker_max_rss_mb") is not None:
+            self.CHART_WORKER_MAX_RSS = data["chart_worker_max_rss_mb"] * 1024 * 1024
+        self.CHART_FORMAT: str = data.get("chart_format", "png")
+        if self.CHART_FORMAT not in CHART_FORMATS:
+            logging.error(f"Unknown chart format '{self.CHART_FORMAT}', png is used instead")
+            self.CHART_FORMAT = "png"
+        self.CHART_DPI: int = data.get("chart_dpi", 100)
+        self.CHART_FIGSIZE: tuple[float, float] = tuple(data.get("chart_figsize", (12, 12)))
+        self.CHART_CACHE_MAX_BYTES: int = data.get("chart_cache_max_mb", 64) * 1024 * 1024
+        self.SCHEDULE_PAGE_SIZE: int = data.get("schedule_page_size", 15)
+        self.METRICS_FILE: str | None = data.get("metrics_file", os.path.join(os.path.dirname(self.DB_FILE), "metrics.prom"))
+        self.METRICS_DUMP_INTERVAL: float = data.get("metrics_dump_interval_seconds", 60)
+        self.REPORTER_WARM_UP: bool = data.get("reporter_warm_up", True)
+        self.REPORTER_BACKEND: str = data.get("reporter_backend", "pandas")
+        if self.REPORTER_BACKEND not in REPORTER_BACKENDS:
+            logging.error(f"Unknown reporter backend '{self.REPORTER_BACKEND}', pandas is used instead")
+            self.REPORTER_BACKEND = "pandas"
+
+        self.metrics: Metrics = Metrics()
 
-        self.input_mode_callback_data: str | None = None
-        self.input_mode_message_alias: str | None = None
\ No newline at end of file
+        self.db: Db = Db(
+            self.DB_FILE,
+            self.MIGRATIONS_FOLDER,
+            self.DB_READERS_COUNT,
+            metrics=self.metrics,
+            journal_mode=self.DB_JOURNAL_MODE,
+            synchronous=self.DB_SYNCHRONOUS,
+            cache_size_kb=self.DB_CACHE_SIZE_KB,
+            cached_statements=self.DB_CACHED_STATEMENTS
+        )
+        self.renderer: ChartRenderer = ChartRenderer(
+            self.CHART_WORKERS,
+            self.CHART_WORKER_MAX_RSS,
+            self.CHART_FORMAT,
+            self.CHART_DPI,
+            self.CHART_FIGSIZE,
+            metrics=self.metrics
+        )
+        self.chart_cache: ChartCache = ChartCache(self.CHART_CACHE_MAX_BYTES)
+        self.reporter: "Reporter | SqlReporter | None" = None
+        self.transfer: LoansTransfer = LoansTransfer(self.db)
+        self.states: ChatStateStore = ChatStateStore(self.db, self.CHAT_STATE_TTL)
+        self.callbacks: CallbackStore = CallbackStore(self.db, self.CALLBACK_TTL)
+
+    async def get_reporter(self) -> "Reporter | SqlReporter":
+        if self.reporter is None:
+            module_name, class_name = REPORTER_BACKENDS[self.REPORTER_BACKEND]
+            # importing pandas takes seconds, so it is done in a thread to keep the event loop responsive
+            with self.metrics.timer("startup_seconds", stage="reporter_import"):
+                reports = await asyncio.get_running_loop().run_in_executor(
+                    None, importlib.import_module, module_name
+                )
+            if self.reporter is None:
+                self.reporter = getattr(reports, class_name)(self.db, self.renderer, self.chart_cache)
+        return self.reporter
+
+    # prepares analytics in background after polling has started, so the first report does not wait for it
+    async def warm_up(self) -> None:
+        try:
+            reporter = await self.get_reporter()
+            with self.metrics.timer("startup_seconds", stage="movements"):
+                await reporter.get_movements()
+            with self.metrics.timer("startup_seconds", stage="chart_workers"):
+                await self.renderer.warm_up()
+        except Exception:
+            logging.error("An error occurred while warming up the reporter")
+            logging.error(format_exc())
@@ -0,0 +1,43 @@
+import argparse
+import asyncio
+import logging
+import sys
+
+from src.context.context import Context
+from src.utils.loans_io import FORMATS, get_format
+
+
+async def run(context: Context, command: str, path: str, file_format: str) -> int:
+    if command == "import":
+        count, errors = await context.transfer.import_file(path, file_format)
+        for error in errors:
+            logging.error(error)
+        if errors:
+            return 1
+        logging.info(f"Imported {count} loans from {path}")
+    else:
+        count = await context.transfer.export_file(path, file_format)
+        logging.info(f"Exported {count} loans to {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        stream=sys.stdout,
+        format="%(pathname)s -- %(asctime)s -- [%(levelname)s] -- \"%(message)s \"")
+    parser = argparse.ArgumentParser(description="Bulk import and export of loans")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="taken from the file extension by default")
+    args = parser.parse_args()
+    file_format = args.format or get_format(args.path)
+    if file_format is None:
+        parser.error(f"cannot guess the format of {args.path}, use --format")
+    context = Context()
+    try:
+        code = asyncio.run(run(context, args.command, args.path, file_format))
+    finally:
+        context.renderer.close()
+        context.db.close()
+    sys.exit(code)
@@ -0,0 +1,39 @@
+import hashlib
+from collections import OrderedDict
+
+
+class Chart:
+    def __init__(self, data: bytes, filename: str):
+        self.data = data
+        self.filename = filename
+        # telegram id of the photo after the first upload, lets next requests skip uploading
+        self.file_id: str | None = None
+
+
+class ChartCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size: int = 0
+        self.entries: OrderedDict[str, list[Chart]] = OrderedDict()
+
+    @staticmethod
+    def get_key(*parts) -> str:
+        return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> list[Chart] | None:
+        charts = self.entries.get(key)
+        if charts is not None:
+            self.entries.move_to_end(key)
+        return charts
+
+    def put(self, key: str, charts: list[Chart]) -> list[Chart]:
+        if key in self.entries:
+            self._evict(key)
+        self.entries[key] = charts
+        self.size += sum(len(c.data) for c in charts)
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            self._evict(next(iter(self.entries)))
+        return charts
+
+    def _evict(self, key: str) -> None:
+        self.size -= sum(len(c.data) for c in self.entries.pop(key))
@@ -0,0 +1,116 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING
+
+from src.utils.metrics import Metrics
+
+# matplotlib is imported by worker processes only, the bot process never draws anything itself
+if TYPE_CHECKING:
+    import numpy as np
+    from matplotlib.figure import Figure
+
+# formats telegram shows as photos
+CHART_FORMATS = ("png", "jpeg", "webp")
+
+# every worker process draws all of its charts on a single figure which is cleared between renders,
+# pyplot is not used at all so there is no global registry of figures that could leak
+_figure: "Figure | None" = None
+_format: str = "png"
+_dpi: int = 100
+
+
+def _init_worker(figsize: tuple[float, float], image_format: str, dpi: int) -> None:
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    global _figure, _format, _dpi
+    _figure = Figure(figsize=figsize)
+    FigureCanvasAgg(_figure)
+    _format = image_format
+    _dpi = dpi
+
+
+def _get_rss() -> int:
+    # ru_maxrss is reported in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def plot_view(
+        title: str,
+        dates: "np.ndarray",
+        positions: "np.ndarray",
+        duties: "np.ndarray",
+        source_name: str | None = None) -> tuple[bytes, int]:
+    _figure.clear()
+    try:
+        ax = _figure.add_subplot()
+        ax.set_title(title)
+        ax.plot(dates, positions, label={source_name if source_name is not None else 'Позиция'})
+        ax.plot(dates, duties, label='Долг')
+        ax.plot(dates, duties + positions,
+                label=f'Ожидаемая доходность',
+                linestyle='--')
+
+        ax.legend()
+        ax.grid()
+        buffer = io.BytesIO()
+        _figure.savefig(buffer, format=_format, dpi=_dpi)
+    finally:
+        _figure.clear()
+    return buffer.getvalue(), _get_rss()
+
+
+class ChartRenderer:
+    def __init__(
+            self,
+            workers: int | None = None,
+            max_worker_rss: int | None = None,
+            image_format: str = "png",
+            dpi: int = 100,
+            figsize: tuple[float, float] = (12, 12),
+            metrics: Metrics | None = None):
+        self.metrics = metrics or Metrics()
+        self.workers = workers
+        self.format = image_format
+        self.dpi = dpi
+        self.figsize = figsize
+        self.max_worker_rss = max_worker_rss
+        self.peak_worker_rss: int = 0
+        self.pool = self._create_pool()
+
+    def _create_pool(self) -> ProcessPoolExecutor:
+        # spawn instead of fork: the bot process already runs an event loop and db threads
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.figsize, self.format, self.dpi)
+        )
+
+    async def render(self, charts: list[tuple]) -> list[bytes]:
+        loop = asyncio.get_running_loop()
+        pool = self.pool
+        results = await asyncio.gather(*(loop.run_in_executor(pool, plot_view, *chart) for chart in charts))
+        rss = max((r for _, r in results), default=0)
+        self.peak_worker_rss = max(self.peak_worker_rss, rss)
+        self.metrics.set("chart_worker_peak_rss_bytes", self.peak_worker_rss)
+        if self.max_worker_rss is not None and rss > self.max_worker_rss and pool is self.pool:
+            logging.warning(f"Chart worker RSS {rss} exceeds {self.max_worker_rss} bytes, restarting workers")
+            self.pool = self._create_pool()
+            pool.shutdown(wait=False)
+            self.metrics.inc("chart_worker_restarts_total")
+        return [image for image, _ in results]
+
+    # starts every worker process ahead of the first render, they import matplotlib in their initializer
+    async def warm_up(self) -> None:
+        loop = asyncio.get_running_loop()
+        pool = self.pool
+        await asyncio.gather(*(loop.run_in_executor(pool, _get_rss) for _ in range(self.workers or os.cpu_count() or 1)))
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=True, cancel_futures=True)
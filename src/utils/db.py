@@ -1,37 +1,387 @@
+import asyncio
 import logging
 import os
+import re
 import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import date
+from pathlib import Path
 from traceback import format_exc
+from typing import Callable, Iterator, Sequence, TypeVar
+
+from src.utils.db_statements import STATEMENTS
+from src.utils.metrics import Metrics
+
+T = TypeVar("T")
+
+JOURNAL_MODES = ("wal", "delete", "truncate", "persist", "memory", "off")
+SYNCHRONOUS_LEVELS = ("off", "normal", "full", "extra")
+# begin, commit, rollback, savepoints of a few nesting levels and pragmas run outside of the registry
+CONTROL_STATEMENTS_COUNT = 16
+
+# dates are stored as numbers of days since 1970-01-01, the same numbers numpy keeps in datetime64[D],
+# so ranges and orders run on integers, they are converted to dates once when read
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def to_day(value: date) -> int:
+    return value.toordinal() - EPOCH_ORDINAL
+
+
+def from_day(day: int) -> date:
+    return date.fromordinal(day + EPOCH_ORDINAL)
 
 
 class Db:
-    def __init__(self, filename: str, migration_folder: str):
+    def __init__(
+            self,
+            filename: str,
+            migration_folder: str,
+            readers_count: int = 4,
+            changes_log_size: int = 10000,
+            metrics: Metrics | None = None,
+            journal_mode: str = "wal",
+            synchronous: str = "full",
+            cache_size_kb: int = 2000,
+            cached_statements: int = 128):
+        if journal_mode not in JOURNAL_MODES:
+            raise ValueError(f"unknown journal mode {journal_mode}")
+        if synchronous not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f"unknown synchronous level {synchronous}")
+        self.metrics = metrics or Metrics()
+        self.cache_size_kb = int(cache_size_kb)
+        # the whole registry has to fit, otherwise statements would be evicted and prepared again,
+        # transaction control statements and pragmas take their slots as well
+        self.cached_statements = max(int(cached_statements), len(STATEMENTS) + CONTROL_STATEMENTS_COUNT)
         logging.info(f"trying to connect to {filename} with migrations from {migration_folder}")
-        with open(os.path.join(migration_folder, "forward.sql"), "rt", encoding='utf-8') as f:
-            queries = f.read().split(';')
-        self.conn = sqlite3.connect(filename)
+        # the only connection allowed to write, it is used exclusively from the writer thread,
+        # transactions are opened explicitly by transaction() instead of implicitly by the sqlite3 module
+        self.conn = sqlite3.connect(
+            filename, check_same_thread=False, isolation_level=None, cached_statements=self.cached_statements
+        )
         self.cur = self.conn.cursor()
-        for query in queries:
-            self.cur.execute(query)
-        self.conn.commit()
+        # names of statements already prepared by the writer connection, readers keep theirs in thread locals
+        self.prepared: set[str] = set()
+        self.cur.execute(f"pragma journal_mode={journal_mode}")
+        self.cur.execute(f"pragma synchronous={synchronous}")
+        self.cur.execute(f"pragma cache_size=-{self.cache_size_kb}")
+        self.transaction_depth: int = 0
+        self.commit_hooks: list[tuple[Callable, tuple]] = []
+        self._migrate(migration_folder)
+        self.reader_uri = f"{Path(filename).absolute().as_uri()}?mode=ro"
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self.readers = ThreadPoolExecutor(max_workers=readers_count, thread_name_prefix="db-reader")
+        self.reader_conns: list[sqlite3.Connection] = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # every committed write that changes loan movements bumps data_version and logs the touched loan ids
+        self.data_version: int = 0
+        self.changes: deque[tuple[int, tuple[int, ...]]] = deque(maxlen=changes_log_size)
+        # parsed unsettled loans, dropped by every write to loans
+        self.unsettled_loans: list[tuple[int, int, str, date, date, int, int, int, str, str]] | None = None
+        self.unsettled_loans_generation: int = 0
+        # sources and legends are small and change rarely, so they are served from memory,
+        # dimensions_version lets the keyboards built from them know when to rebuild
+        self.source_names: dict[int, str] = dict(self._get_sources(self.cur))
+        self.legend_source_names: dict[int, str] = dict(self._get_legend_sources(self.cur))
+        self.sources: list[tuple[int, str]] = self._sort_by_name(self.source_names)
+        self.legend_sources: list[tuple[int, str]] = self._sort_by_name(self.legend_source_names)
+        self.dimensions_version: int = 0
+        # changes with every commit of other connections to the file, e.g. an import by loans_cli
+        # while the bot runs, the writer sees none of its own commits there
+        self.external_version: int = self.cur.execute("pragma data_version").fetchone()[0]
         logging.info("Successfully connected")
 
-    def update_loan_comment(self, loan_id: int, comment: str) -> bool:
-        query = f'''
-            update loans
-            set comment = '{comment}'
-            where id = {loan_id}
-            returning id
-        '''
-        self.cur.execute(query)
-        res = self.cur.fetchall()
-        if len(res) != 1:
+    @staticmethod
+    def _sort_by_name(names: dict[int, str]) -> list[tuple[int, str]]:
+        return sorted(names.items(), key=lambda x: x[1])
+
+    def _invalidate_unsettled_loans(self) -> None:
+        with self.lock:
+            self.unsettled_loans = None
+            self.unsettled_loans_generation += 1
+
+    def _touch(self, *loan_ids: int) -> None:
+        with self.lock:
+            self.data_version += 1
+            self.changes.append((self.data_version, loan_ids))
+
+    # forgets the log of changes so that every reader of changes_since rereads everything
+    def _reset_changes(self) -> None:
+        with self.lock:
+            self.data_version += 1
+            self.changes.clear()
+
+    # returns current data version and ids of loans changed after the given one,
+    # None instead of ids means the log does not cover the gap and everything has to be reread
+    def changes_since(self, version: int) -> tuple[int, set[int] | None]:
+        with self.lock:
+            if version == self.data_version:
+                return version, set()
+            if version < 0 or not self.changes or self.changes[0][0] > version + 1:
+                return self.data_version, None
+            loan_ids = set()
+            for change_version, change_ids in reversed(self.changes):
+                if change_version <= version:
+                    break
+                loan_ids.update(change_ids)
+            return self.data_version, loan_ids
+
+    # groups writes into a single commit, a nested transaction becomes a savepoint that rolls back alone,
+    # so a write method can be a part of a bigger one, functions passed to write can use it as well
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        depth = self.transaction_depth
+        hooks_count = len(self.commit_hooks)
+        self.cur.execute("begin immediate" if depth == 0 else f"savepoint transaction_{depth}")
+        self.transaction_depth += 1
+        try:
+            yield self.cur
+            self.cur.execute("commit" if depth == 0 else f"release transaction_{depth}")
+        except BaseException:
+            if depth == 0:
+                if self.conn.in_transaction:
+                    self.cur.execute("rollback")
+            else:
+                self.cur.execute(f"rollback to transaction_{depth}")
+                self.cur.execute(f"release transaction_{depth}")
+            del self.commit_hooks[hooks_count:]
+            raise
+        finally:
+            self.transaction_depth = depth
+        if depth == 0:
+            hooks, self.commit_hooks = self.commit_hooks, []
+            for func, args in hooks:
+                func(*args)
+
+    # readers run every statement in its own snapshot, this keeps several of them on the same one
+    @contextmanager
+    def read_transaction(self, cur: sqlite3.Cursor) -> Iterator[sqlite3.Cursor]:
+        cur.execute("begin")
+        try:
+            yield cur
+        finally:
+            cur.execute("commit")
+
+    # caches and versions seen by readers change only after the outermost commit,
+    # otherwise a reader could cache the old data under the new version
+    def _after_commit(self, func: Callable, *args) -> None:
+        if self.transaction_depth == 0:
+            func(*args)
+        else:
+            self.commit_hooks.append((func, args))
+
+    def _migrate(self, migration_folder: str) -> None:
+        self.cur.execute('''
+            create table if not exists schema_version
+            (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        current_version = self._execute(self.cur, "get_schema_version").fetchone()[0]
+        migrations = []
+        for name in os.listdir(migration_folder):
+            match = re.fullmatch(r"(\d+)_\w+\.sql", name)
+            if match is not None and int(match[1]) > current_version:
+                migrations.append((int(match[1]), name))
+        for version, name in sorted(migrations):
+            logging.info(f"applying migration {name}")
+            with open(os.path.join(migration_folder, name), "rt", encoding='utf-8') as f:
+                script = f.read()
+            try:
+                self.conn.executescript(
+                    f"begin;\n{script}\n;\n"
+                    f"insert into schema_version (version, name) values ({version}, '{name}');\n"
+                    f"commit;"
+                )
+            except:
+                logging.error(f"An error occurred while applying migration {name}")
+                self.conn.rollback()
+                raise
+        logging.info(f"schema version is {max([current_version] + [v for v, _ in migrations])}")
+
+    def _reader_cursor(self) -> sqlite3.Cursor:
+        cur = getattr(self.local, "cur", None)
+        if cur is None:
+            conn = sqlite3.connect(
+                self.reader_uri, uri=True, check_same_thread=False, cached_statements=self.cached_statements
+            )
+            conn.execute(f"pragma cache_size=-{self.cache_size_kb}")
+            with self.lock:
+                self.reader_conns.append(conn)
+            self.local.prepared = set()
+            cur = self.local.cur = conn.cursor()
+        return cur
+
+    # sqlite3 keeps a prepared statement per connection for every distinct text, so only the first run
+    # of a statement on a connection parses and plans it, the counters show how often that happens
+    def _execute(self, cur: sqlite3.Cursor, name: str, params: Sequence = ()) -> sqlite3.Cursor:
+        self._count_statement(cur, name)
+        return cur.execute(STATEMENTS[name], params)
+
+    def _execute_many(self, name: str, rows: list[Sequence]) -> sqlite3.Cursor:
+        self._count_statement(self.cur, name)
+        return self.cur.executemany(STATEMENTS[name], rows)
+
+    def _count_statement(self, cur: sqlite3.Cursor, name: str) -> None:
+        prepared = self.prepared if cur is self.cur else self.local.prepared
+        cached = name in prepared
+        prepared.add(name)
+        self.metrics.inc("db_statements_total", statement=name, cache="hit" if cached else "miss")
+
+    def _run_read(self, func: Callable[..., T], *args) -> T:
+        return self._run_measured("read", func, self._reader_cursor(), *args)
+
+    # time is measured inside the executor thread, so waiting for a free reader or the writer is not included
+    def _run_measured(self, kind: str, func: Callable[..., T], *args) -> T:
+        started = time.perf_counter()
+        res = func(*args)
+        method = func.__name__.lstrip('_')
+        self.metrics.observe("db_query_seconds", time.perf_counter() - started, kind=kind, method=method)
+        if isinstance(res, list):
+            self.metrics.inc("db_rows_total", len(res), method=method)
+        return res
+
+    async def read(self, func: Callable[..., T], *args) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self.readers, self._run_read, func, *args)
+
+    async def write(self, func: Callable[..., T], *args) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self.writer, self._run_measured, "write", func, *args)
+
+    def close(self) -> None:
+        self.readers.shutdown(wait=True)
+        self.writer.shutdown(wait=True)
+        for conn in self.reader_conns:
+            conn.close()
+        self.conn.close()
+
+    async def update_loan_comment(self, loan_id: int, comment: str) -> bool:
+        return await self.write(self._update_loan_comment, loan_id, comment)
+
+    async def create_loan(
+            self,
+            source_id: int,
+            loan_date: date,
+            amount: int,
+            reward: int,
+            expected_settle_date: date,
+            legend_source_id: int,
+            previous_loan_id: int = None) -> bool:
+        return await self.write(self._create_loan, source_id, loan_date, amount, reward,
+                                expected_settle_date, legend_source_id, previous_loan_id)
+
+    async def settle_loan(self, loan_id: int, settle_date: date, amount: int = None, new_reward: int = None, new_expected_settle_date: date = None) -> bool:
+        return await self.write(self._settle_loan, loan_id, settle_date, amount, new_reward, new_expected_settle_date)
+
+    async def import_loans(self, loans: list[tuple]) -> bool:
+        return await self.write(self._import_loans, loans)
+
+    async def add_source(self, name: str) -> bool:
+        return await self.write(self._add_source, name)
+
+    async def add_legend_source(self, name: str) -> bool:
+        return await self.write(self._add_legend_source, name)
+
+    async def get_sources(self) -> list[tuple[int, str]]:
+        return self.sources
+
+    async def get_source_name_by_id(self, source_id: int) -> str:
+        return self.source_names.get(source_id, "")
+
+    async def get_legend_sources(self) -> list[tuple[int, str]]:
+        return self.legend_sources
+
+    async def get_legend_source_name_by_id(self, legend_id: int) -> str:
+        return self.legend_source_names.get(legend_id, "")
+
+    async def get_loan_amount_and_reward(self, loan_id: int) -> tuple[int, int]:
+        return await self.read(self._get_loan_amount_and_reward, loan_id)
+
+    # commits of other processes bypass the log of changes and the caches, so they are dropped as a whole,
+    # called before serving anything cached from the loans
+    async def sync_external_changes(self) -> bool:
+        return await self.write(self._sync_external_changes)
+
+    async def get_unsettled_loans(self) -> list[tuple[int, int, str, date, date, int, int, int, str, str]]:
+        await self.sync_external_changes()
+        with self.lock:
+            loans, generation = self.unsettled_loans, self.unsettled_loans_generation
+        if loans is not None:
+            self.metrics.inc("cache_requests_total", cache="unsettled_loans", result="hit")
+            return loans
+        self.metrics.inc("cache_requests_total", cache="unsettled_loans", result="miss")
+        loans = await self.read(self._get_unsettled_loans)
+        with self.lock:
+            if generation == self.unsettled_loans_generation:
+                self.unsettled_loans = loans
+        return loans
+
+    async def get_schedule_summary(self) -> tuple[int, int, int]:
+        return await self.read(self._get_schedule_summary)
+
+    async def get_schedule_page(self, offset: int, limit: int) -> list[tuple[date, int, int, list[tuple]]]:
+        return await self.read(self._get_schedule_page, offset, limit)
+
+    async def get_chat_state(self, chat_id: int) -> tuple[str, float] | None:
+        return await self.read(self._get_chat_state, chat_id)
+
+    async def save_chat_state(self, chat_id: int, state: str, updated_at: float) -> bool:
+        return await self.write(self._save_chat_state, chat_id, state, updated_at)
+
+    async def delete_chat_states(self, updated_before: float) -> bool:
+        return await self.write(self._delete_chat_states, updated_before)
+
+    async def get_max_callback_payload_id(self) -> int:
+        return await self.read(self._get_max_callback_payload_id)
+
+    async def get_callback_payload(self, payload_id: int) -> tuple[str, str, float | None] | None:
+        return await self.read(self._get_callback_payload, payload_id)
+
+    async def get_pinned_callback_payloads(self) -> list[tuple[int, str, str]]:
+        return await self.read(self._get_pinned_callback_payloads)
+
+    async def save_callback_payloads(self, payloads: list[tuple[int, str, str, float | None]]) -> bool:
+        return await self.write(self._save_callback_payloads, payloads)
+
+    async def delete_callback_payloads(self, expired_before: float) -> bool:
+        return await self.write(self._delete_callback_payloads, expired_before)
+
+    def _sync_external_changes(self) -> bool:
+        version = self.cur.execute("pragma data_version").fetchone()[0]
+        if version == self.external_version:
             return False
-        self.conn.commit()
+        logging.info("The db was changed by another connection, dropping cached data")
+        self.external_version = version
+        source_names = dict(self._get_sources(self.cur))
+        legend_source_names = dict(self._get_legend_sources(self.cur))
+        with self.lock:
+            self.source_names, self.legend_source_names = source_names, legend_source_names
+            self.sources = self._sort_by_name(source_names)
+            self.legend_sources = self._sort_by_name(legend_source_names)
+            self.dimensions_version += 1
+        self._invalidate_unsettled_loans()
+        self._reset_changes()
         return True
 
-    def create_loan(
+    def _update_loan_comment(self, loan_id: int, comment: str | None) -> bool:
+        try:
+            with self.transaction():
+                if len(self._execute(self.cur, "update_loan_comment", (comment, loan_id)).fetchall()) != 1:
+                    raise ValueError(f"there is no loan {loan_id}")
+                self._after_commit(self._invalidate_unsettled_loans)
+        except:
+            logging.error("An error occurred while updating loan comment")
+            logging.error(format_exc())
+            return False
+        return True
+
+    def _create_loan(
             self,
             source_id: int,
             loan_date: date,
@@ -40,184 +390,225 @@ class Db:
             expected_settle_date: date,
             legend_source_id: int,
             previous_loan_id: int = None) -> bool:
-        query = f'''
-            insert into loans
-            (source_id, 
-            loan_date, 
-            amount, 
-            expected_settle_date, 
-            reward, 
-            legend_source_id)
-            values
-            (
-            {source_id},
-            '{loan_date.strftime("%Y-%m-%d")}',
-            {amount},
-            '{expected_settle_date.strftime("%Y-%m-%d")}',
-            {reward},
-            {legend_source_id}
-            )
-            returning id
-        '''
         try:
-            self.cur.execute(query)
-            res = self.cur.fetchone()[0]
+            with self.transaction():
+                res = self._execute(self.cur, "create_loan", (
+                    source_id,
+                    to_day(loan_date),
+                    amount,
+                    to_day(expected_settle_date),
+                    reward,
+                    legend_source_id
+                )).fetchone()[0]
+                if previous_loan_id is not None:
+                    self._execute(self.cur, "set_next_loan", (res, previous_loan_id))
+                self._add_daily_movement(loan_date, source_id, legend_source_id, -amount, amount + reward)
+                self._after_commit(self._invalidate_unsettled_loans)
+                self._after_commit(self._touch, res)
         except:
             logging.error("An error occurred while creating new loan")
             logging.error(format_exc())
             return False
-        if previous_loan_id is not None:
-            query = f'''
-                update loans
-                set next_loan_id = {res}
-                where id = {previous_loan_id}
-            '''
-            try:
-                self.cur.execute(query)
-            except:
-                logging.error("An error occurred while prolonging previous loan")
-                logging.error(format_exc())
-                return False
-        self.conn.commit()
         return True
 
-    def settle_loan(self, loan_id: int, settle_date: date, amount: int = None, new_reward: int = None, new_expected_settle_date: date = None) -> bool:
-        query = f'''
-            select source_id, legend_source_id, amount + reward, comment
-            from loans
-            where id = {loan_id}
-        '''
+    # a prolongation settles the loan and creates the next one in a single transaction
+    def _settle_loan(self, loan_id: int, settle_date: date, amount: int = None, new_reward: int = None, new_expected_settle_date: date = None) -> bool:
         try:
-            self.cur.execute(query)
+            with self.transaction():
+                source_id, legend_id, new_amount, comment, old_settle_date = self._execute(
+                    self.cur, "get_loan_to_settle", (loan_id,)
+                ).fetchone()
+                self._execute(self.cur, "settle_loan", (to_day(settle_date), loan_id))
+                # settling a settled loan again moves its payback to the new date
+                if old_settle_date is not None:
+                    self._add_daily_movement(old_settle_date, source_id, legend_id, -new_amount, new_amount, -1)
+                self._add_daily_movement(settle_date, source_id, legend_id, new_amount, -new_amount)
+                if amount is not None and new_reward is not None and new_expected_settle_date is not None:
+                    if not self._create_loan(source_id, settle_date, new_amount - amount,
+                                             new_reward, new_expected_settle_date, legend_id, loan_id):
+                        raise RuntimeError(f"cannot create the loan prolonging {loan_id}")
+                    if not self._update_loan_comment(loan_id, comment):
+                        raise RuntimeError(f"cannot keep the comment of {loan_id}")
+                self._after_commit(self._invalidate_unsettled_loans)
+                self._after_commit(self._touch, loan_id)
         except:
+            logging.error("An error occurred while settling loan")
             logging.error(format_exc())
             return False
-        source_id, legend_id, new_amount, comment = self.cur.fetchone()
-        query = f'''
-            update loans
-            set settle_date = '{settle_date.strftime("%Y-%m-%d")}'
-            where id = {loan_id}
-        '''
+        return True
+
+    # loans are (id or None, source_id, loan_date, amount, expected_settle_date, reward,
+    # settle_date or None, next_loan_id or None, legend_source_id, comment or None) with dates as days,
+    # all of them or none are inserted
+    def _import_loans(self, loans: list[tuple]) -> bool:
         try:
-            self.cur.execute(query)
+            with self.transaction():
+                self._execute_many("import_loans", loans)
+                if self._execute(self.cur, "count_dangling_next_loans").fetchone()[0] != 0:
+                    raise ValueError("next_loan_id refers to a loan that does not exist")
+                self._rebuild_daily_positions()
+                self._after_commit(self._invalidate_unsettled_loans)
+                self._after_commit(self._reset_changes)
         except:
+            logging.error("An error occurred while importing loans")
             logging.error(format_exc())
             return False
-        if amount is not None and new_reward is not None and new_expected_settle_date is not None:
-            if not self.create_loan(source_id, settle_date, new_amount - amount,
-                                new_reward, new_expected_settle_date, legend_id, loan_id):
-                return False
-            if not self.update_loan_comment(loan_id, comment):
-                return False
-        self.conn.commit()
         return True
 
-    def add_source(self, name: str) -> bool:
-        query = f'''
-            insert into sources
-            (name)
-            values
-            ('{name}')
-        '''
+    # adds a day movement to the series of the source, of the legend and of all loans,
+    # positions of the later days of these series include it as well, count -1 takes a movement back
+    def _add_daily_movement(
+            self,
+            day: date | int,
+            source_id: int,
+            legend_id: int,
+            movement: int,
+            duty: int,
+            count: int = 1) -> None:
+        if isinstance(day, date):
+            day = to_day(day)
+        for series in ((source_id, 0), (0, legend_id), (0, 0)):
+            position, total_duty = self._execute(
+                self.cur, "get_previous_daily_position", (*series, day)
+            ).fetchone() or (0, 0)
+            self._execute(self.cur, "add_daily_movement", (
+                day, *series, movement, duty, position + movement, total_duty + duty, count
+            ))
+            if count < 0:
+                self._execute(self.cur, "delete_empty_daily_position", (day, *series))
+            self._execute(self.cur, "shift_daily_positions", (movement, duty, *series, day))
+
+    # used after bulk changes of loans
+    def _rebuild_daily_positions(self) -> None:
+        self._execute(self.cur, "clear_daily_positions")
+        self._execute(self.cur, "rebuild_daily_positions")
+
+    def _add_source(self, name: str) -> bool:
         try:
-            self.cur.execute(query)
+            with self.transaction():
+                source_id = self._execute(self.cur, "add_source", (name,)).fetchone()[0]
+                self._after_commit(self._remember_source, source_id, name)
         except:
             logging.error("An error occurred while adding source")
             logging.error(format_exc())
             return False
-        self.conn.commit()
         return True
 
-    def add_legend_source(self, name: str):
-        query = f'''
-                insert into legend_sources
-                (name)
-                values
-                ('{name}')
-                '''
+    def _add_legend_source(self, name: str):
         try:
-            self.cur.execute(query)
+            with self.transaction():
+                legend_id = self._execute(self.cur, "add_legend_source", (name,)).fetchone()[0]
+                self._after_commit(self._remember_legend_source, legend_id, name)
         except:
             logging.error("An error occurred while adding source")
             logging.error(format_exc())
             return False
-        self.conn.commit()
         return True
 
-    def get_sources(self) -> list[tuple[int, str]]:
-        query = f'''
-            select id, name
-            from sources
-            order by name
-        '''
-        self.cur.execute(query)
-        return self.cur.fetchall()
-
-    def get_source_name_by_id(self, source_id: int) -> str:
-        query = f'''
-            select name
-            from sources
-            where id = {source_id}
-        '''
-        self.cur.execute(query)
-        res = self.cur.fetchall()
-        if len(res) == 1:
-            return res[0][0]
-        return ""
-
-    def get_legend_sources(self) -> list[tuple[int, str]]:
-        query = f'''
-            select id, name
-            from legend_sources
-            order by name
-        '''
-        self.cur.execute(query)
-        return self.cur.fetchall()
-
-    def get_legend_source_name_by_id(self, legend_id: int) -> str:
-        query = f'''
-                    select name
-                    from legend_sources
-                    where id = {legend_id}
-                '''
-        self.cur.execute(query)
-        res = self.cur.fetchall()
-        if len(res) == 1:
-            return res[0][0]
-        return ""
-
-    def get_loan_amount_and_reward(self, loan_id: int) -> tuple[int, int]:
-        query  = f'''
-            select amount + reward, reward
-            from loans
-            where id = {loan_id}
-        '''
-        self.cur.execute(query)
+    def _remember_source(self, source_id: int, name: str) -> None:
+        with self.lock:
+            self.source_names[source_id] = name
+            self.sources = self._sort_by_name(self.source_names)
+            self.dimensions_version += 1
+
+    def _remember_legend_source(self, legend_id: int, name: str) -> None:
+        with self.lock:
+            self.legend_source_names[legend_id] = name
+            self.legend_sources = self._sort_by_name(self.legend_source_names)
+            self.dimensions_version += 1
+
+    def _get_sources(self, cur: sqlite3.Cursor) -> list[tuple[int, str]]:
+        return self._execute(cur, "get_sources").fetchall()
+
+    def _get_legend_sources(self, cur: sqlite3.Cursor) -> list[tuple[int, str]]:
+        return self._execute(cur, "get_legend_sources").fetchall()
+
+    def _get_loan_amount_and_reward(self, cur: sqlite3.Cursor, loan_id: int) -> tuple[int, int]:
+        self._execute(cur, "get_loan_amount_and_reward", (loan_id,))
         try:
-            return self.cur.fetchone()
+            return cur.fetchone()
         except:
             logging.error("Something went wrong while getting loan amount by id")
             logging.error(format_exc())
             return 0, 0
 
-    def get_unsettled_loans(self) -> list[tuple[int, int, str, str, str, int, int, int, str, str]]:
-        query = f'''
-            select 
-                l.id, 
-                l.source_id, 
-                s.name as source_name, 
-                l.loan_date, 
-                l.expected_settle_date, 
-                l.amount, 
-                l.amount + l.reward as total,
-                l.legend_source_id,
-                sl.name as legend_name,
-                comment
-            from 
-                loans l left join sources s on l.source_id = s.id left join legend_sources sl on sl.id = l.legend_source_id
-            where
-                settle_date is null
-            order by l.expected_settle_date asc
-        '''
-        self.cur.execute(query)
-        return self.cur.fetchall()
+    def _get_unsettled_loans(self, cur: sqlite3.Cursor) -> list[tuple[int, int, str, date, date, int, int, int, str, str]]:
+        return [
+            (loan_id, source_id, source_name, from_day(loan_date),
+             from_day(expected_settle_date), amount, total, legend_id, legend_name, comment)
+            for (loan_id, source_id, source_name, loan_date, expected_settle_date,
+                 amount, total, legend_id, legend_name, comment) in self._execute(cur, "get_unsettled_loans").fetchall()
+        ]
+
+    def _get_schedule_summary(self, cur: sqlite3.Cursor) -> tuple[int, int, int]:
+        return self._execute(cur, "get_schedule_summary").fetchone()
+
+    # unsettled loans from offset grouped by due date, each day comes with its totals over all of its loans
+    def _get_schedule_page(self, cur: sqlite3.Cursor, offset: int, limit: int) -> list[tuple[date, int, int, list[tuple]]]:
+        # a loan settled between the two queries would leave a day of the page without totals
+        with self.read_transaction(cur):
+            rows = self._execute(cur, "get_schedule_page", (limit, offset)).fetchall()
+            if not rows:
+                return []
+            day_totals = {
+                dt: (count, total)
+                for dt, count, total in self._execute(cur, "get_schedule_day_totals", (rows[0][0], rows[-1][0])).fetchall()
+            }
+        days = []
+        for expected_settle_date, loan_date, amount, total, legend_name, comment, source_name in rows:
+            if not days or days[-1][0] != expected_settle_date:
+                days.append((expected_settle_date, *day_totals[expected_settle_date], []))
+            days[-1][3].append((from_day(loan_date), amount, total, legend_name, comment, source_name))
+        return [(from_day(dt), total, count, loans) for dt, count, total, loans in days]
+
+    def _get_chat_state(self, cur: sqlite3.Cursor, chat_id: int) -> tuple[str, float] | None:
+        return self._execute(cur, "get_chat_state", (chat_id,)).fetchone()
+
+    def _save_chat_state(self, chat_id: int, state: str, updated_at: float) -> bool:
+        try:
+            with self.transaction():
+                self._execute(self.cur, "save_chat_state", (chat_id, state, updated_at))
+        except:
+            logging.error("An error occurred while saving chat state")
+            logging.error(format_exc())
+            return False
+        return True
+
+    def _delete_chat_states(self, updated_before: float) -> bool:
+        try:
+            with self.transaction():
+                self._execute(self.cur, "delete_chat_states", (updated_before,))
+        except:
+            logging.error("An error occurred while deleting expired chat states")
+            logging.error(format_exc())
+            return False
+        return True
+
+    def _get_max_callback_payload_id(self, cur: sqlite3.Cursor) -> int:
+        return self._execute(cur, "get_max_callback_payload_id").fetchone()[0]
+
+    def _get_callback_payload(self, cur: sqlite3.Cursor, payload_id: int) -> tuple[str, str, float | None] | None:
+        return self._execute(cur, "get_callback_payload", (payload_id,)).fetchone()
+
+    def _get_pinned_callback_payloads(self, cur: sqlite3.Cursor) -> list[tuple[int, str, str]]:
+        return self._execute(cur, "get_pinned_callback_payloads").fetchall()
+
+    def _save_callback_payloads(self, payloads: list[tuple[int, str, str, float | None]]) -> bool:
+        try:
+            with self.transaction():
+                self._execute_many("save_callback_payloads", payloads)
+        except:
+            logging.error("An error occurred while saving callback payloads")
+            logging.error(format_exc())
+            return False
+        return True
+
+    def _delete_callback_payloads(self, expired_before: float) -> bool:
+        try:
+            with self.transaction():
+                self._execute(self.cur, "delete_callback_payloads", (expired_before,))
+        except:
+            logging.error("An error occurred while deleting expired callback payloads")
+            logging.error(format_exc())
+            return False
+        return True
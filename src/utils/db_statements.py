@@ -0,0 +1,304 @@
+# every statement Db runs, by name, values are always bound as parameters so that the text of a statement
+# never changes and sqlite3 keeps it prepared in the statement cache of every connection
+STATEMENTS: dict[str, str] = {
+    "get_schema_version": '''
+        select coalesce(max(version), 0)
+        from schema_version
+    ''',
+    "update_loan_comment": '''
+        update loans
+        set comment = ?
+        where id = ?
+        returning id
+    ''',
+    "create_loan": '''
+        insert into loans
+        (source_id,
+        loan_date,
+        amount,
+        expected_settle_date,
+        reward,
+        legend_source_id)
+        values
+        (?, ?, ?, ?, ?, ?)
+        returning id
+    ''',
+    "set_next_loan": '''
+        update loans
+        set next_loan_id = ?
+        where id = ?
+    ''',
+    "get_loan_to_settle": '''
+        select source_id, legend_source_id, amount + reward, comment, settle_date
+        from loans
+        where id = ?
+    ''',
+    "settle_loan": '''
+        update loans
+        set settle_date = ?
+        where id = ?
+    ''',
+    "import_loans": '''
+        insert into loans
+        (id,
+        source_id,
+        loan_date,
+        amount,
+        expected_settle_date,
+        reward,
+        settle_date,
+        next_loan_id,
+        legend_source_id,
+        comment)
+        values
+        (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''',
+    "count_dangling_next_loans": '''
+        select count(*)
+        from loans
+        where next_loan_id is not null and next_loan_id not in (select id from loans)
+    ''',
+    "get_previous_daily_position": '''
+        select position, duty
+        from daily_positions
+        where source_id = ? and legend_source_id = ? and date < ?
+        order by date desc
+        limit 1
+    ''',
+    "add_daily_movement": '''
+        insert into daily_positions
+        (date, source_id, legend_source_id, day_movement, day_duty, position, duty, movements_count)
+        values
+        (?, ?, ?, ?, ?, ?, ?, ?)
+        on conflict (date, source_id, legend_source_id) do update
+        set day_movement = day_movement + excluded.day_movement,
+            day_duty = day_duty + excluded.day_duty,
+            position = position + excluded.day_movement,
+            duty = duty + excluded.day_duty,
+            movements_count = movements_count + excluded.movements_count
+    ''',
+    "shift_daily_positions": '''
+        update daily_positions
+        set position = position + ?, duty = duty + ?
+        where source_id = ? and legend_source_id = ? and date > ?
+    ''',
+    "delete_empty_daily_position": '''
+        delete from daily_positions
+        where date = ? and source_id = ? and legend_source_id = ? and movements_count = 0
+    ''',
+    "clear_daily_positions": '''
+        delete from daily_positions
+    ''',
+    # the same query as in the migration that created daily_positions
+    "rebuild_daily_positions": '''
+        with movements(source_id, legend_source_id, date, movement, duty) as (
+            select source_id, legend_source_id, loan_date, -amount, amount + reward
+            from loans
+            union all
+            select source_id, legend_source_id, settle_date, amount + reward, -(amount + reward)
+            from loans
+            where settle_date is not null
+        ),
+        daily(source_id, legend_source_id, date, movement, duty, movements_count) as (
+            select source_id, 0, date, sum(movement), sum(duty), count(*)
+            from movements group by source_id, date
+            union all
+            select 0, legend_source_id, date, sum(movement), sum(duty), count(*)
+            from movements group by legend_source_id, date
+            union all
+            select 0, 0, date, sum(movement), sum(duty), count(*)
+            from movements group by date
+        )
+        insert into daily_positions
+        (date, source_id, legend_source_id, day_movement, day_duty, position, duty, movements_count)
+        select date, source_id, legend_source_id, movement, duty, sum(movement) over w, sum(duty) over w, movements_count
+        from daily
+        window w as (partition by source_id, legend_source_id order by date)
+    ''',
+    "add_source": '''
+        insert into sources
+        (name)
+        values
+        (?)
+        returning id
+    ''',
+    "add_legend_source": '''
+        insert into legend_sources
+        (name)
+        values
+        (?)
+        returning id
+    ''',
+    "get_sources": '''
+        select id, name
+        from sources
+        order by name
+    ''',
+    "get_legend_sources": '''
+        select id, name
+        from legend_sources
+        order by name
+    ''',
+    "get_loan_amount_and_reward": '''
+        select amount + reward, reward
+        from loans
+        where id = ?
+    ''',
+    "get_unsettled_loans": '''
+        select
+            l.id,
+            l.source_id,
+            s.name as source_name,
+            l.loan_date,
+            l.expected_settle_date,
+            l.amount,
+            l.amount + l.reward as total,
+            l.legend_source_id,
+            sl.name as legend_name,
+            comment
+        from
+            loans l left join sources s on l.source_id = s.id left join legend_sources sl on sl.id = l.legend_source_id
+        where
+            settle_date is null
+        order by l.expected_settle_date asc
+    ''',
+    "get_schedule_summary": '''
+        select count(*), coalesce(sum(amount), 0), coalesce(sum(amount + reward), 0)
+        from loans
+        where settle_date is null
+    ''',
+    "get_schedule_page": '''
+        select
+            l.expected_settle_date,
+            l.loan_date,
+            l.amount,
+            l.amount + l.reward as total,
+            sl.name as legend_name,
+            l.comment,
+            s.name as source_name
+        from
+            loans l left join sources s on l.source_id = s.id left join legend_sources sl on sl.id = l.legend_source_id
+        where
+            settle_date is null
+        order by l.expected_settle_date asc, l.id asc
+        limit ? offset ?
+    ''',
+    "get_schedule_day_totals": '''
+        select expected_settle_date, count(*), sum(amount + reward)
+        from loans
+        where settle_date is null and expected_settle_date between ? and ?
+        group by expected_settle_date
+    ''',
+    # movements of loans for the pandas reporter, all of them or the ones of a json array of ids,
+    # so the text does not depend on the count of ids
+    "get_loan_movements": '''
+        select
+            l.id as loan_id,
+            s.name as source_name,
+            sl.name as legend_name,
+            l.loan_date,
+            l.settle_date,
+            l.amount,
+            l.amount + l.reward as total
+        from loans l
+            left join sources s on l.source_id = s.id
+            left join legend_sources sl on sl.id = l.legend_source_id
+    ''',
+    "get_loan_movements_by_ids": '''
+        select
+            l.id as loan_id,
+            s.name as source_name,
+            sl.name as legend_name,
+            l.loan_date,
+            l.settle_date,
+            l.amount,
+            l.amount + l.reward as total
+        from loans l
+            left join sources s on l.source_id = s.id
+            left join legend_sources sl on sl.id = l.legend_source_id
+        where l.id in (select value from json_each(?))
+    ''',
+    # positions of a range of days for the sql reporter, a series of a source has legend_source_id 0,
+    # a series of a legend has source_id 0, the unary plus keeps sqlite on the primary key range of dates
+    # instead of the series index, which would scan the whole history of all sources or legends
+    "get_total_positions": '''
+        select source_id, date, day_movement, day_duty, position, duty
+        from daily_positions
+        where date >= ? and date < ? and source_id = 0 and legend_source_id = 0
+        order by date
+    ''',
+    "get_source_positions": '''
+        select source_id, date, day_movement, day_duty, position, duty
+        from daily_positions
+        where date >= ? and date < ? and source_id != 0 and +legend_source_id = 0
+        order by source_id, date
+    ''',
+    "get_legend_positions": '''
+        select legend_source_id, date, day_movement, day_duty, position, duty
+        from daily_positions
+        where date >= ? and date < ? and legend_source_id != 0 and +source_id = 0
+        order by legend_source_id, date
+    ''',
+    # dates are formatted back from days since the epoch, 2440587.5 is the julian day of 1970-01-01
+    "export_loans": '''
+        select
+            l.id,
+            s.name,
+            sl.name,
+            date(2440587.5 + l.loan_date),
+            l.amount,
+            l.reward,
+            date(2440587.5 + l.expected_settle_date),
+            date(2440587.5 + l.settle_date),
+            l.next_loan_id,
+            l.comment
+        from loans l
+            left join sources s on l.source_id = s.id
+            left join legend_sources sl on sl.id = l.legend_source_id
+        order by l.id
+    ''',
+    "get_chat_state": '''
+        select state, updated_at
+        from chat_states
+        where chat_id = ?
+    ''',
+    "save_chat_state": '''
+        insert into chat_states
+        (chat_id, state, updated_at)
+        values
+        (?, ?, ?)
+        on conflict (chat_id) do update
+        set state = excluded.state, updated_at = excluded.updated_at
+    ''',
+    "delete_chat_states": '''
+        delete from chat_states
+        where updated_at < ?
+    ''',
+    "get_max_callback_payload_id": '''
+        select coalesce(max(id), 0)
+        from callback_payloads
+    ''',
+    "get_callback_payload": '''
+        select prefix, args, expires_at
+        from callback_payloads
+        where id = ?
+    ''',
+    "get_pinned_callback_payloads": '''
+        select id, prefix, args
+        from callback_payloads
+        where expires_at is null
+        order by id
+    ''',
+    "save_callback_payloads": '''
+        insert into callback_payloads
+        (id, prefix, args, expires_at)
+        values
+        (?, ?, ?, ?)
+        on conflict (id) do update
+        set expires_at = excluded.expires_at
+    ''',
+    "delete_callback_payloads": '''
+        delete from callback_payloads
+        where expires_at < ?
+    ''',
+}
@@ -0,0 +1,144 @@
+import asyncio
+import csv
+import json
+import os
+from datetime import date
+from sqlite3 import Cursor
+from typing import Iterator, TextIO
+
+from src.utils.db import Db, to_day
+
+FIELDS = [
+    "id",
+    "source",
+    "legend",
+    "loan_date",
+    "amount",
+    "reward",
+    "expected_settle_date",
+    "settle_date",
+    "next_loan_id",
+    "comment"
+]
+FORMATS = ("csv", "jsonl")
+MAX_REPORTED_ERRORS = 10
+EXPORT_BATCH_SIZE = 1000
+
+
+def get_format(filename: str) -> str | None:
+    extension = os.path.splitext(filename)[1].lstrip('.').lower()
+    return extension if extension in FORMATS else None
+
+
+# moves loans between the db and csv/jsonl files, sources and legends are referred to by their names
+class LoansTransfer:
+    def __init__(self, db: Db):
+        self.db = db
+
+    # returns the number of imported loans and the list of errors, nothing is imported if there are any
+    async def import_file(self, path: str, file_format: str) -> tuple[int, list[str]]:
+        source_ids = {name: source_id for source_id, name in self.db.source_names.items()}
+        legend_ids = {name: legend_id for legend_id, name in self.db.legend_source_names.items()}
+        loans, errors = await asyncio.get_running_loop().run_in_executor(
+            None, self._read_loans, path, file_format, source_ids, legend_ids
+        )
+        if errors:
+            return 0, errors
+        if not await self.db.import_loans(loans):
+            return 0, ["не удалось записать займы, подробности в логах"]
+        return len(loans), errors
+
+    async def export_file(self, path: str, file_format: str) -> int:
+        with open(path, "wt", encoding='utf-8', newline='') as f:
+            return await self.db.read(self._write_loans, f, file_format)
+
+    def _read_loans(
+            self,
+            path: str,
+            file_format: str,
+            source_ids: dict[str, int],
+            legend_ids: dict[str, int]) -> tuple[list[tuple], list[str]]:
+        loans, errors = [], []
+        try:
+            with open(path, "rt", encoding='utf-8', newline='') as f:
+                for line_number, record in self._read_records(f, file_format):
+                    try:
+                        loans.append(self._parse_record(record, source_ids, legend_ids))
+                    except Exception as err:
+                        errors.append(f"строка {line_number}: {err}")
+                        if len(errors) >= MAX_REPORTED_ERRORS:
+                            break
+        except Exception as err:
+            errors.append(f"файл не удалось прочитать: {err}")
+        return loans, errors
+
+    @staticmethod
+    def _read_records(f: TextIO, file_format: str) -> Iterator[tuple[int, dict | str]]:
+        if file_format == "csv":
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+        else:
+            for line_number, line in enumerate(f, start=1):
+                if line.strip():
+                    yield line_number, line
+
+    @staticmethod
+    def _parse_record(record: dict | str, source_ids: dict[str, int], legend_ids: dict[str, int]) -> tuple:
+        if isinstance(record, str):
+            record = json.loads(record)
+        def get(field: str, required: bool = True) -> str | None:
+            value = record.get(field)
+            value = None if value is None or str(value).strip() == "" else str(value).strip()
+            if value is None and required:
+                raise ValueError(f"нет значения {field}")
+            return value
+
+        source_id = source_ids.get(get("source"))
+        if source_id is None:
+            raise ValueError(f"источник '{get('source')}' не найден")
+        legend_id = legend_ids.get(get("legend"))
+        if legend_id is None:
+            raise ValueError(f"легенда '{get('legend')}' не найдена")
+        loan_date = date.fromisoformat(get("loan_date"))
+        expected_settle_date = date.fromisoformat(get("expected_settle_date"))
+        settle_date = get("settle_date", False)
+        if settle_date is not None:
+            settle_date = date.fromisoformat(settle_date)
+            if settle_date < loan_date:
+                raise ValueError("settle_date раньше loan_date")
+        amount = int(get("amount"))
+        reward = int(get("reward"))
+        if amount <= 0 or reward < 0:
+            raise ValueError("amount должен быть положительным, reward - неотрицательным")
+        if expected_settle_date < loan_date:
+            raise ValueError("expected_settle_date раньше loan_date")
+        loan_id = get("id", False)
+        next_loan_id = get("next_loan_id", False)
+        return (
+            int(loan_id) if loan_id is not None else None,
+            source_id,
+            to_day(loan_date),
+            amount,
+            to_day(expected_settle_date),
+            reward,
+            to_day(settle_date) if settle_date is not None else None,
+            int(next_loan_id) if next_loan_id is not None else None,
+            legend_id,
+            get("comment", False)
+        )
+
+    # rows are fetched and written by batches, so the whole table is never held in memory
+    def _write_loans(self, cur: Cursor, f: TextIO, file_format: str) -> int:
+        self.db._execute(cur, "export_loans")
+        writer = csv.writer(f)
+        if file_format == "csv":
+            writer.writerow(FIELDS)
+        count = 0
+        while rows := cur.fetchmany(EXPORT_BATCH_SIZE):
+            if file_format == "csv":
+                writer.writerows(rows)
+            else:
+                f.writelines(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + "\n" for row in rows)
+            count += len(rows)
+        return count
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from traceback import format_exc
+from typing import Iterator
+
+# upper bounds of histogram buckets in seconds, the last one is +Inf
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts: list[int] = [0] * (len(BUCKETS) + 1)
+        self.sum: float = 0.
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # upper bound of the bucket holding the quantile, good enough to see where time goes
+    def quantile(self, q: float) -> float:
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+# thread safe since the db observes its queries from executor threads
+class Metrics:
+    def __init__(self, prefix: str = "haperych"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.histograms: dict[str, dict[Labels, Histogram]] = dict()
+        self.counters: dict[str, dict[Labels, float]] = dict()
+        self.gauges: dict[str, dict[Labels, float]] = dict()
+        self.started_at: float = time.time()
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            histograms = self.histograms.setdefault(name, dict())
+            if key not in histograms:
+                histograms[key] = Histogram()
+            histograms[key].observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counters = self.counters.setdefault(name, dict())
+            counters[key] = counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.gauges.setdefault(name, dict())[key] = value
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _format_labels(labels: Labels, **extra: str) -> str:
+        pairs = list(labels) + list(extra.items())
+        if not pairs:
+            return ""
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            for name, histograms in sorted(self.histograms.items()):
+                full_name = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {full_name} histogram")
+                for labels, histogram in sorted(histograms.items()):
+                    cumulative = 0
+                    for bound, count in zip(list(BUCKETS) + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        lines.append(f"{full_name}_bucket{self._format_labels(labels, le=str(bound))} {cumulative}")
+                    lines.append(f"{full_name}_sum{self._format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{full_name}_count{self._format_labels(labels)} {histogram.count}")
+            for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+                for name, values in sorted(metrics.items()):
+                    full_name = f"{self.prefix}_{name}"
+                    lines.append(f"# TYPE {full_name} {kind}")
+                    for labels, value in sorted(values.items()):
+                        lines.append(f"{full_name}{self._format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    # short human readable report for the /stats command
+    def get_summary(self) -> str:
+        lines = [f"Статистика за {(time.time() - self.started_at) / 3600:.1f} ч"]
+        with self.lock:
+            for name, histograms in sorted(self.histograms.items()):
+                lines.append(f"\n{name}: кол-во, среднее / p50 / p95 / p99 мс")
+                for labels, h in sorted(histograms.items(), key=lambda x: -x[1].sum):
+                    lines.append(
+                        f"{' '.join(v for _, v in labels) or '-'}: {h.count}, {h.sum / max(h.count, 1) * 1000:.1f} / "
+                        f"≤{h.quantile(0.5) * 1000:g} / ≤{h.quantile(0.95) * 1000:g} / ≤{h.quantile(0.99) * 1000:g}"
+                    )
+            for name, values in sorted(self.counters.items()) + sorted(self.gauges.items()):
+                lines.append(f"\n{name}:")
+                for labels, value in sorted(values.items()):
+                    lines.append(f"{' '.join(v for _, v in labels) or '-'}: {value:g}")
+        return "\n".join(lines)
+
+    def dump(self, filename: str) -> None:
+        # written next to the target and renamed so that a scraper never reads a half written file
+        with open(filename + ".tmp", "wt", encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(filename + ".tmp", filename)
+
+    async def dump_periodically(self, filename: str, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.dump(filename)
+            except Exception:
+                logging.error(f"An error occurred while dumping metrics to {filename}")
+                logging.error(format_exc())
@@ -0,0 +1,53 @@
+from datetime import date
+
+import numpy as np
+
+# a series of positions by day, all arrays are ordered by day: days as datetime64[D], movements and duties
+# of every day, and running sums of them, so the position before any day is the one of the previous day
+Positions = tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+def get_range(positions: Positions, start: date | None = None, end: date | None = None) -> Positions:
+    days, day_movements, day_duties, running_positions, duties = positions
+    i = 0 if start is None else int(np.searchsorted(days, np.datetime64(start, "D")))
+    j = len(days) if end is None else int(np.searchsorted(days, np.datetime64(end, "D")))
+    running_positions = running_positions[i:j]
+    if start is not None and j > i:
+        # the range starts from its opening duty instead of the whole history,
+        # the opening values are the running sums of the day before the first one of the range
+        opening_position = running_positions[0] - day_movements[i]
+        opening_duty = duties[i] - day_duties[i]
+        running_positions = running_positions - opening_position - opening_duty
+    return days[i:j], day_movements[i:j], day_duties[i:j], running_positions, duties[i:j]
+
+
+# chart views for the renderer: all loans first, then every series ordered by its first day in the range and name,
+# series without movements in the range are skipped, an empty list means there is nothing to draw
+def get_views(
+        total: Positions,
+        series: list[tuple[str, Positions]],
+        source_id: str,
+        start: date | None = None,
+        end: date | None = None) -> list[tuple]:
+    days, _, _, positions, duties = get_range(total, start, end)
+    if len(days) == 0:
+        return []
+    min_all_source_position = positions.min()
+    last_all_source_position = positions[-1]
+    last_all_source_duty = duties[-1]
+    all_source_roi = last_all_source_position / max(-min_all_source_position, 1.)
+    views = [(
+        f"Проект Хапэрыч, динамика позиции.\n"
+        f"Рентабельность за период: {all_source_roi:.2%}.\n"
+        f"Позиция: {last_all_source_position}. Долг: {last_all_source_duty}",
+        days, positions, duties, None
+    )]
+    ranges = [(name, get_range(positions, start, end)) for name, positions in series]
+    ranges = sorted(((name, view) for name, view in ranges if len(view[0]) != 0), key=lambda x: (x[1][0][0], x[0]))
+    for name, (days, _, _, positions, duties) in ranges:
+        views.append((
+            f"Проект Хапэрыч, динамика позиций источнику: {name}"
+            f"({'реальный' if source_id == 'source_name' else 'легенда'})",
+            days, positions, duties, name
+        ))
+    return views
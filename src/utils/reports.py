@@ -1,116 +1,166 @@
-import os.path
-from sqlite3 import Connection
-from datetime import date, datetime
+import asyncio
+import json
+from datetime import date
+from sqlite3 import Cursor
 
+import numpy as np
 import pandas as pd
-from matplotlib import pyplot as plt
+
+from src.utils.chart_cache import Chart, ChartCache
+from src.utils.charts import ChartRenderer
+from src.utils.db import Db
+from src.utils.positions import Positions, get_views
 
 
 class Reporter:
-    def __init__(self, db_conn: Connection):
-        self.conn = db_conn
-        self.movements: pd.DataFrame = pd.DataFrame(columns=["source_name", "legend_name", "date", "movement"])
+    def __init__(self, db: Db, renderer: ChartRenderer, cache: ChartCache):
+        self.db = db
+        self.renderer = renderer
+        self.cache = cache
+        self.version: int = -1
+        self.lock = asyncio.Lock()
+        # version, total and series positions by the column the charts are grouped by
+        self.indexes: dict[str, tuple[int, Positions, list[tuple[str, Positions]]]] = dict()
+        self.movements: pd.DataFrame = pd.DataFrame(
+            columns=["loan_id", "source_name", "legend_name", "date", "movement", "duty"]
+        )
+
+    # frames are built in a thread so that a big rebuild does not stall other chats,
+    # the lock keeps concurrent callers from rebuilding the same version twice
+    async def get_movements(self) -> None:
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            await self.db.sync_external_changes()
+            version, loan_ids = self.db.changes_since(self.version)
+            if loan_ids is None:
+                with self.db.metrics.timer("reporter_seconds", stage="movements_full"):
+                    loans = await self.db.read(self._read_loans)
+                    self.movements = await loop.run_in_executor(None, self._build_movements, loans)
+            elif len(loan_ids) != 0:
+                with self.db.metrics.timer("reporter_seconds", stage="movements_incremental"):
+                    loans = await self.db.read(self._read_loans, sorted(loan_ids))
+                    self.movements = await loop.run_in_executor(
+                        None, self._update_movements, self.movements, loan_ids, loans
+                    )
+            self.version = version
+            self._report_memory()
+
+    def _update_movements(self, movements: pd.DataFrame, loan_ids: set[int], loans: pd.DataFrame) -> pd.DataFrame:
+        kept = movements[~movements["loan_id"].isin(loan_ids)]
+        return self._merge_sorted(kept, self._build_movements(loans))
+
+    def _read_loans(self, cur: Cursor, loan_ids: list[int] | None = None) -> pd.DataFrame:
+        if loan_ids is None:
+            self.db._execute(cur, "get_loan_movements")
+        else:
+            # ids are passed as a single json array, so the text of the query does not depend on their count
+            self.db._execute(cur, "get_loan_movements_by_ids", (json.dumps(loan_ids),))
+        return pd.DataFrame.from_records(cur.fetchall(), columns=[column[0] for column in cur.description])
+
+    # movements keep dates as int32 days since the epoch, names as categoricals and money as int64,
+    # about 30 bytes per movement, so groupbys run on integer keys
+    @staticmethod
+    def _build_movements(df: pd.DataFrame) -> pd.DataFrame:
+        settled = df["settle_date"].notna().to_numpy()
+        # every loan moves money out on its loan date and settled ones move it back on their settle date
+        rows = np.concatenate([np.arange(len(df)), np.flatnonzero(settled)])
+        amount = df["amount"].to_numpy(np.int64)
+        total = df["total"].to_numpy(np.int64)
+        # dates are read as days since the epoch already, settle dates are floats because of nulls
+        days = np.concatenate([df["loan_date"].to_numpy(np.int32), df["settle_date"].to_numpy()[settled].astype(np.int32)])
+        order = np.argsort(days, kind="stable")
+        rows = rows[order]
+        return pd.DataFrame({
+            "loan_id": df["loan_id"].to_numpy(np.int32)[rows],
+            "source_name": pd.Categorical(df["source_name"])[rows],
+            "legend_name": pd.Categorical(df["legend_name"])[rows],
+            "date": days[order],
+            "movement": np.concatenate([-amount, total[settled]])[order],
+            "duty": np.concatenate([total, -total[settled]])[order]
+        })
 
-    def get_movements(self) -> str:
-        query = f'''
-            select
-                s.name as source_name,
-                sl.name as legend_name,
-                l.loan_date,
-                l.settle_date,
-                l.amount,
-                l.amount + l.reward as total
-            from loans l 
-                left join sources s on l.source_id = s.id 
-                left join legend_sources sl on sl.id = l.legend_source_id
-        '''
-        df = pd.read_sql(query, self.conn)
-        loans = df[["source_name", "legend_name", "loan_date", "amount", "total"]].copy()
-        loans["amount"] *= -1
-        loans = loans.rename(columns={"loan_date": "date", "amount": "movement", "total": "duty"})
-        paybacks = df[df["settle_date"].notna()][["source_name", "legend_name", "settle_date", "total"]]
-        paybacks["duty"] = -paybacks["total"]
-        paybacks = paybacks.rename(columns={"settle_date": "date", "total": "movement"})
-        self.movements = pd.concat([loans, paybacks])
-        self.movements["date"] = self.movements["date"].apply(lambda x: datetime.strptime(x, "%Y-%m-%d"))
-        self.movements.sort_values(by=['date'], inplace=True)
+    # both frames are sorted by date, rows of the second one go after equal dates of the first one
+    @staticmethod
+    def _merge_sorted(movements: pd.DataFrame, changed: pd.DataFrame) -> pd.DataFrame:
+        if len(changed) == 0:
+            return movements.reset_index(drop=True)
+        if len(movements) == 0:
+            return changed
+        # concat turns categoricals with different categories into objects, new names are added to both first
+        for column in ("source_name", "legend_name"):
+            categories = movements[column].cat.categories.union(changed[column].cat.categories)
+            movements = movements.assign(**{column: movements[column].cat.set_categories(categories)})
+            changed = changed.assign(**{column: changed[column].cat.set_categories(categories)})
+        positions = movements["date"].searchsorted(changed["date"], side="right") + np.arange(len(changed))
+        order = np.empty(len(movements) + len(changed), dtype=np.int64)
+        is_old = np.ones(len(order), dtype=bool)
+        is_old[positions] = False
+        order[is_old] = np.arange(len(movements))
+        order[positions] = np.arange(len(movements), len(order))
+        return pd.concat([movements, changed], ignore_index=True).take(order).reset_index(drop=True)
 
-    def get_graphic_by_sources(self, source_id: str = 'source_name', year: int | None = None, month: int | None = None) -> list[str]:
-        data = self.movements[[source_id, "date", "movement", "duty"]]
-        data = data.rename(columns={source_id: "source"})
-        positions = data.groupby(["source", "date"]).sum().groupby(level=0).cumsum().reset_index()
-        positions.rename(columns={"movement": "position"}, inplace=True)
-        positions.sort_values(by="date", inplace=True)
-        all_source_positions = positions[["date", "position", "duty"]].groupby("date").sum().reset_index()
-        all_source_positions.sort_values(by="date", inplace=True)
-        if year is not None:
-            all_source_positions = all_source_positions[all_source_positions["date"].dt.year == year]
-            positions = positions[positions["date"].dt.year == year]
-            if month is not None:
-                all_source_positions = all_source_positions[all_source_positions["date"].dt.month == month]
-                positions = positions[positions["date"].dt.month == month]
-            ss = positions["source"].unique()
-            for source in ss:
-                days = positions[positions["source"] == source]
-                if len(days) == 0:
-                    continue
-                first_day = days["date"].iloc[0]
-                first_duty = days["duty"].iloc[0]
-                first_pos = days["position"].iloc[0]
-                movs = self.movements[(self.movements[source_id] == source) & (self.movements["date"] == first_day)][["date", "movement", "duty"]].groupby("date").sum().reset_index()
-                duty = movs.duty.iloc[0] if len(movs) > 0 else 0
-                mov = movs.movement.iloc[0] if len(movs) > 0 else 0
-                delta = duty + mov - first_duty - first_pos
-                positions.loc[positions["source"] == source, ["position"]] += delta
-            if len(all_source_positions) != 0:
-                first_day = all_source_positions["date"].iloc[0]
-                first_duty = all_source_positions["duty"].iloc[0]
-                first_pos = all_source_positions["position"].iloc[0]
-                movs = self.movements[self.movements["date"] == first_day][["date", "movement", "duty"]].groupby("date").sum().reset_index()
-                duty = movs.duty.iloc[0] if len(movs) > 0 else 0
-                mov = movs.movement.iloc[0] if len(movs) > 0 else 0
-                delta = duty + mov - first_duty - first_pos
-                all_source_positions["position"] += delta
-        sources = positions["source"].unique()
+    # sizes of the movements columns in bytes, exposed as gauges next to the other metrics
+    def get_memory_report(self) -> dict[str, int]:
+        return {column: int(size) for column, size in self.movements.memory_usage(deep=True, index=False).items()}
 
-        plt.ioff()
-        result_files: list[str] = []
-        plt.figure(figsize=(12, 12))
-        min_all_source_position = all_source_positions["position"].min()
-        last_all_source_position = all_source_positions["position"].iloc[-1]
-        last_all_source_duty = all_source_positions["duty"].iloc[-1]
-        all_source_roi = last_all_source_position / max(-min_all_source_position, 1.)
-        plt.title(f"Проект Хапэрыч, динамика позиции.\n"
-                  f"Рентабельность за период: {all_source_roi:.2%}.\n"
-                  f"Позиция: {last_all_source_position}. Долг: {last_all_source_duty}")
-        result_files.append(
-            self._plot_view(all_source_positions, self._create_filename(None, year, month))
-            )
-        for i, source in enumerate(sources):
-            plt.figure(figsize=(12, 12))
-            plt.title(f"Проект Хапэрыч, динамика позиций источнику: {source}"
-                      f"({'реальный' if source_id == 'source_name' else 'легенда'})")
-            result_files.append(
-                self._plot_view(positions[positions["source"] == source], self._create_filename(i, year, month), source)
+    def _report_memory(self) -> None:
+        for column, size in self.get_memory_report().items():
+            self.db.metrics.set("reporter_movements_bytes", size, column=column)
+        self.db.metrics.set("reporter_movements_rows", len(self.movements))
+
+    async def get_graphic_by_sources(
+            self,
+            source_id: str = 'source_name',
+            start: date | None = None,
+            end: date | None = None) -> list[Chart]:
+        key = self.cache.get_key(source_id, start, end, self.version)
+        charts = self.cache.get(key)
+        self.db.metrics.inc("cache_requests_total", cache="charts", result="hit" if charts is not None else "miss")
+        if charts is None:
+            with self.db.metrics.timer("reporter_seconds", stage="charts"):
+                views = await asyncio.get_running_loop().run_in_executor(
+                    None, self._get_charts, self.movements, self.version, source_id, start, end
                 )
-        return result_files
-    
-    def _plot_view(self, view: pd.DataFrame, filename: str, source_name: str|None = None) -> str:
-        plt.plot(view["date"], view["position"], label={source_name if source_name is not None else 'Позиция'})
-        plt.plot(view["date"], view["duty"], label='Долг')
-        plt.plot(view["date"], view["duty"] + view["position"],
-                    label=f'Ожидаемая доходность',
-                    linestyle='--')
-        
-        plt.legend()
-        plt.grid()
-        plt.savefig(filename)
-        return filename
-    
-    def _create_filename(self, source: None|int = None, year: None|int = None, month: None|int = None) -> str:
-        tmp_folder = "./tmp"
-        os.makedirs(tmp_folder, exist_ok=True)
-        result_file = (f"report_by_{source if source is not None else 'all'}_"
-                        f"{'all' if year is None else year}"
-                        f"{'' if month is None or year is None else '_'+str(month)}.png")
-        return os.path.join(tmp_folder, result_file)
+            with self.db.metrics.timer("reporter_seconds", stage="render"):
+                images = await self.renderer.render(views) if views else []
+            charts = self.cache.put(key, [
+                Chart(image, f"report_{i}.{self.renderer.format}") for i, image in enumerate(images)
+            ])
+        return charts
+
+    # positions of every series are built once per version, any range is then two binary searches per series
+    def _get_charts(
+            self,
+            movements: pd.DataFrame,
+            version: int,
+            source_id: str,
+            start: date | None,
+            end: date | None) -> list[tuple]:
+        index_version, total, series = self.indexes.get(source_id, (-1, None, None))
+        if index_version != version:
+            total, series = self._build_index(movements, source_id)
+            self.indexes[source_id] = (version, total, series)
+        return get_views(total, series, source_id, start, end)
+
+    @staticmethod
+    def _build_index(movements: pd.DataFrame, source_id: str) -> tuple[Positions, list[tuple[str, Positions]]]:
+        data = movements[[source_id, "date", "movement", "duty"]].dropna(subset=[source_id])
+        total_daily = data.drop(columns=source_id).groupby("date").sum()
+        total = Reporter._to_positions(total_daily.index.to_numpy(), total_daily, total_daily.cumsum())
+        daily = data.groupby([source_id, "date"], observed=True).sum()
+        if len(daily) == 0:
+            return total, []
+        positions = Reporter._to_positions(
+            daily.index.get_level_values(1).to_numpy(), daily, daily.groupby(level=0, observed=True).cumsum()
+        )
+        # rows are ordered by series, so every series is a contiguous slice of the arrays
+        codes = daily.index.codes[0]
+        bounds = np.flatnonzero(np.diff(codes)) + 1
+        names = daily.index.levels[0][codes[np.concatenate([[0], bounds])]]
+        columns = [np.split(array, bounds) for array in positions]
+        return total, [(str(name), tuple(column[i] for column in columns)) for i, name in enumerate(names)]
+
+    @staticmethod
+    def _to_positions(days: np.ndarray, daily: pd.DataFrame, running: pd.DataFrame) -> Positions:
+        return (days.astype("datetime64[D]"), daily["movement"].to_numpy(), daily["duty"].to_numpy(),
+                running["movement"].to_numpy(), running["duty"].to_numpy())
@@ -0,0 +1,78 @@
+from datetime import date
+from sqlite3 import Cursor
+
+import numpy as np
+
+from src.utils.chart_cache import Chart, ChartCache
+from src.utils.charts import ChartRenderer
+from src.utils.db import Db, to_day
+from src.utils.positions import Positions, get_views
+
+# days bounding the whole history when a range is open
+_FIRST_DAY, _LAST_DAY = -2 ** 31, 2 ** 31
+
+# positions are kept per day by the db in daily_positions, every series has its own rows:
+# a source with legend_source_id 0, a legend with source_id 0 and all loans with both of them 0,
+# so a chart reads only the days of its period
+_STATEMENTS = {"source_name": "get_source_positions", "legend_name": "get_legend_positions"}
+
+
+# same charts as Reporter, but read from positions kept by the db instead of a pandas frame of all loans
+class SqlReporter:
+    def __init__(self, db: Db, renderer: ChartRenderer, cache: ChartCache):
+        self.db = db
+        self.renderer = renderer
+        self.cache = cache
+        self.version: int = -1
+
+    # nothing is kept in memory, charts are read from the db of the current version
+    async def get_movements(self) -> None:
+        await self.db.sync_external_changes()
+        self.version = self.db.data_version
+
+    async def get_graphic_by_sources(
+            self,
+            source_id: str = 'source_name',
+            start: date | None = None,
+            end: date | None = None) -> list[Chart]:
+        key = self.cache.get_key(source_id, start, end, self.version)
+        charts = self.cache.get(key)
+        self.db.metrics.inc("cache_requests_total", cache="charts", result="hit" if charts is not None else "miss")
+        if charts is None:
+            with self.db.metrics.timer("reporter_seconds", stage="charts"):
+                views = await self.db.read(self._get_charts, source_id, start, end)
+            with self.db.metrics.timer("reporter_seconds", stage="render"):
+                images = await self.renderer.render(views) if views else []
+            charts = self.cache.put(key, [
+                Chart(image, f"report_{i}.{self.renderer.format}") for i, image in enumerate(images)
+            ])
+        return charts
+
+    # returns ids of series and their positions, rows of a series are contiguous
+    def _read_positions(self, cur: Cursor, name: str, start: date | None, end: date | None) -> tuple[np.ndarray, Positions]:
+        rows = self.db._execute(cur, name, (
+            to_day(start) if start is not None else _FIRST_DAY,
+            to_day(end) if end is not None else _LAST_DAY
+        )).fetchall()
+        if not rows:
+            return np.empty(0, dtype=np.int64), (np.empty(0, dtype="datetime64[D]"),
+                                                 *(np.empty(0, dtype=np.int64) for _ in range(4)))
+        series, dates, *values = zip(*rows)
+        # days since the epoch are what datetime64[D] keeps, so they are viewed as dates without parsing
+        return np.array(series, dtype=np.int64), (np.array(dates, dtype=np.int64).astype("datetime64[D]"),
+                                                  *(np.array(column, dtype=np.int64) for column in values))
+
+    def _get_charts(self, cur: Cursor, source_id: str, start: date | None, end: date | None) -> list[tuple]:
+        names = self.db.source_names if source_id == "source_name" else self.db.legend_source_names
+        # the total and the series are read from the same snapshot, so a commit between them cannot mix two states
+        with self.db.read_transaction(cur):
+            _, total = self._read_positions(cur, "get_total_positions", start, end)
+            ids, positions = self._read_positions(cur, _STATEMENTS[source_id], start, end)
+        series = []
+        if len(ids) != 0:
+            bounds = np.flatnonzero(np.diff(ids)) + 1
+            columns = [np.split(array, bounds) for array in positions]
+            for i, first in enumerate(np.concatenate([[0], bounds])):
+                series.append((names.get(int(ids[first]), ""), tuple(column[i] for column in columns)))
+        # the rows are read for the range only, so ranging them again just rebases them on their opening
+        return get_views(total, series, source_id, start, end)
@@ -1,8 +1,9 @@
 import base64
 
 
-def encode(s: str) -> str:
-    return str(base64.b64encode(bytes(s, encoding='utf-8')), encoding='utf-8')
+def encode(n: int) -> str:
+    return str(base64.urlsafe_b64encode(n.to_bytes(max((n.bit_length() + 7) // 8, 1), 'big')), encoding='utf-8').rstrip('=')
 
-def decode(s: str) -> str:
-    return str(base64.b64decode(bytes(s, encoding='utf-8')), encoding='utf-8')
\ No newline at end of file
+# characters out of the urlsafe alphabet are errors instead of being skipped
+def decode(s: str) -> int:
+    return int.from_bytes(base64.b64decode(bytes(s + '=' * (-len(s) % 4), encoding='utf-8'), altchars=b'-_', validate=True), 'big')